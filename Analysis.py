@@ -0,0 +1,149 @@
+import os, multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from Database import *
+
+
+def analyze(restriction=dict(), time_lim=(-2.5, 5), bin_size=0.25, sessions_per_task=20, max_workers=None):
+    """ Trial aligned lick analysis of all sessions in restriction, the python equivalent of beh.Lick.plotTrial
+    sessions are fetched in bulk, sessions_per_task at a time, and analyzed in parallel
+    time_lim: psth window around the trial start (s)
+    bin_size: psth bin size (s)
+    returns list of per session results, see analyze_session
+    """
+    keys = (Session() & Trial() & restriction).fetch('KEY', order_by=('animal_id', 'session_id'))
+    chunks = [keys[i:i + sessions_per_task] for i in range(0, len(keys), sessions_per_task)]
+    context = multiprocessing.get_context('spawn')  # workers open their own db connection
+    with ProcessPoolExecutor(max_workers=max_workers if max_workers else os.cpu_count(), mp_context=context) as pool:
+        results = pool.map(analyze_sessions, chunks, [time_lim] * len(chunks), [bin_size] * len(chunks))
+    return sum(results, [])
+
+
+def analyze_sessions(keys, time_lim=(-2.5, 5), bin_size=0.25):
+    """ Fetch a group of sessions with one query per table and analyze each of them """
+    fields = ('animal_id', 'session_id')
+    trials = fetch_arrays(Trial() & keys, *fields, 'trial_idx', 'cond_idx', 'start_time', 'end_time')
+    licks = fetch_arrays(Lick() & keys, *fields, 'time', 'probe')
+    rewards = fetch_arrays(RewardCond() & keys, *fields, 'cond_idx', 'probe')
+    liquid = fetch_arrays(LiquidDelivery() & keys, *fields, 'time', 'probe')
+    trials, licks, rewards, liquid = [split_sessions(data, keys) for data in (trials, licks, rewards, liquid)]
+    return [analyze_session(key, trials[i], licks[i], rewards[i], liquid[i], time_lim, bin_size)
+            for i, key in enumerate(keys)]
+
+
+def analyze_session(key, trials, licks, rewards, liquid, time_lim=(-2.5, 5), bin_size=0.25):
+    """ Lick psth, first lick latency & performance of each condition of a session
+    a lick belongs to the last trial starting more than -time_lim[0] before it, until the next trial starts
+    a trial is responded if there is a lick between its start & end, and correct if liquid was delivered then
+    returns dict with the session key and
+        conds: condition indexes
+        trials: number of trials of each condition
+        probes: lick probes of the psth
+        psth: lick rate (Hz) of each condition, probe & bin
+        bins: bin edges (s)
+        latency: median first lick latency after the trial start of each condition (s)
+        responded: responded fraction of the trials of each condition
+        performance: correct fraction of the responded trials of each condition
+        reward_match: fraction of responded trials whose first lick was at the rewarded probe
+    """
+    order = np.argsort(trials['start_time'], kind='stable')
+    trials = {field: values[order] for field, values in trials.items()}
+    starts, ends = trials['start_time'] / 1000, trials['end_time'] / 1000
+    conds, trial_cond = np.unique(trials['cond_idx'], return_inverse=True)
+    ntrials = len(starts)
+    bins = np.arange(time_lim[0], time_lim[1] + bin_size / 2, bin_size)
+    result = dict(key, conds=conds, bins=bins, trials=np.bincount(trial_cond, minlength=len(conds)))
+
+    # assign licks to trials
+    lick_times = licks['time'] / 1000
+    lick_trial = np.searchsorted(starts + time_lim[0], lick_times, side='right') - 1
+    next_start = np.append(starts[1:], np.inf)
+    valid = (lick_trial >= 0)
+    valid[valid] &= lick_times[valid] < next_start[lick_trial[valid]]
+    lick_trial, lick_probe = lick_trial[valid], licks['probe'][valid]
+    lick_rel = lick_times[valid] - starts[lick_trial]
+
+    # psth of each condition & probe
+    probes, probe_idx = np.unique(lick_probe, return_inverse=True)
+    in_window = (lick_rel >= bins[0]) & (lick_rel < bins[-1])
+    bin_idx = np.int64(np.floor((lick_rel[in_window] - bins[0]) / bin_size))
+    flat = (trial_cond[lick_trial[in_window]] * len(probes) + probe_idx[in_window]) * (len(bins) - 1) + bin_idx
+    counts = np.bincount(flat, minlength=len(conds) * len(probes) * (len(bins) - 1))
+    counts = counts.reshape(len(conds), len(probes), len(bins) - 1)
+    result['probes'] = probes
+    result['psth'] = counts / np.maximum(result['trials'], 1)[:, np.newaxis, np.newaxis] / bin_size
+
+    # first response lick of each trial
+    after = lick_rel >= 0
+    first_time = np.full(ntrials, np.inf)
+    np.minimum.at(first_time, lick_trial[after], lick_rel[after])
+    is_first = after & (lick_rel == first_time[lick_trial])
+    first_probe = np.zeros(ntrials, dtype=np.int64)
+    first_probe[lick_trial[is_first][::-1]] = lick_probe[is_first][::-1]  # earliest lick wins on ties
+    responded = first_time <= ends - starts
+
+    # rewarded trials
+    liquid_times = liquid['time'] / 1000
+    liquid_trial = np.searchsorted(starts, liquid_times, side='right') - 1
+    rewarded_in_trial = (liquid_trial >= 0)
+    rewarded_in_trial[rewarded_in_trial] &= liquid_times[rewarded_in_trial] <= ends[liquid_trial[rewarded_in_trial]]
+    correct = np.zeros(ntrials, dtype=bool)
+    correct[liquid_trial[rewarded_in_trial]] = True
+    reward_probe = np.zeros(max(np.max(conds, initial=0), np.max(rewards['cond_idx'], initial=0)) + 1, dtype=np.int64)
+    reward_probe[rewards['cond_idx']] = rewards['probe']
+
+    # per condition summaries
+    def per_cond(values, mask):
+        sums = np.bincount(trial_cond[mask], weights=values[mask], minlength=len(conds))
+        return sums / np.maximum(np.bincount(trial_cond[mask], minlength=len(conds)), 1)
+    all_trials = np.ones(ntrials, dtype=bool)
+    result['responded'] = per_cond(np.double(responded), all_trials)
+    result['performance'] = per_cond(np.double(correct), responded)
+    result['reward_match'] = per_cond(np.double(first_probe == reward_probe[trials['cond_idx']]), responded)
+    result['latency'] = np.array([np.median(first_time[responded & (trial_cond == i)])
+                                  if np.any(responded & (trial_cond == i)) else np.nan for i in range(len(conds))])
+    return result
+
+
+def analyze_export(root, animal_ids=None, time_lim=(-2.5, 5), bin_size=0.25):
+    """ Same as analyze, on the memory mapped sessions of a columnar export, see Export """
+    from Export import exported_sessions, load_session
+    results = []
+    for key in exported_sessions(root, animal_ids):
+        data = load_session(root, key, ('Trial', 'Lick', 'RewardCond', 'LiquidDelivery'))
+        results.append(analyze_session(key, data['Trial'], data['Lick'], data['RewardCond'], data['LiquidDelivery'],
+                                       time_lim, bin_size))
+    return results
+
+
+def learning_curves(results):
+    """ Performance across the sessions of each animal
+    returns dict of animal_id: (session ids, performance of all responded trials, number of trials)
+    """
+    curves = dict()
+    for result in results:
+        responded = result['responded'] * result['trials']
+        performance = np.sum(result['performance'] * responded) / max(np.sum(responded), 1)
+        curves.setdefault(result['animal_id'], []).append((result['session_id'], performance,
+                                                           np.sum(result['trials'])))
+    return {animal_id: tuple(np.array(values) for values in zip(*sorted(sessions)))
+            for animal_id, sessions in curves.items()}
+
+
+def fetch_arrays(relation, *fields):
+    """ Fetch fields as a dict of numpy arrays """
+    values = relation.fetch(*fields)
+    return dict(zip(fields, [np.asarray(value) for value in values]))
+
+
+def split_sessions(data, keys):
+    """ Split fetched arrays into the sessions of keys """
+    codes = data['animal_id'].astype(np.int64) << 32 | data['session_id'].astype(np.int64)
+    order = np.argsort(codes, kind='stable')
+    codes = codes[order]
+    sessions = []
+    for key in keys:
+        code = np.int64(key['animal_id']) << 32 | np.int64(key['session_id'])
+        idx = order[np.searchsorted(codes, code, side='left'):np.searchsorted(codes, code, side='right')]
+        sessions.append({field: values[idx] for field, values in data.items()})
+    return sessions
@@ -1,6 +1,7 @@
 from LickSpout import *
 from Timer import *
-import pygame
+from Registry import LazyModule
+pygame = LazyModule('pygame')  # only the keyboard of DummyProbe needs it
 
 
 class Behavior:
@@ -54,6 +55,7 @@ class RPBehavior(Behavior):
         if probe > 0:
             #print(self.resp_timer.elapsed_time())
             self.resp_timer.start()
+            self.logger.trace.mark('behavior')
         return probe
 
     def is_ready(self):
@@ -0,0 +1,87 @@
+import sys, time
+import numpy as np
+from Timer import FramePacer
+from Database import *
+
+
+def sweep(valve, probes, pulse_durs, pulse_num, pulse_interval, weigh=None, display=None):
+    """ Delivers pulse_num pulses of each duration of pulse_durs on all probes at once
+    pulses start on a fixed schedule of one pulse every pulse_dur + pulse_interval (ms)
+    weigh: function(pulse_dur, probes) returning the weight (gr) released by each probe, asks the operator by default
+    display: function(text) showing the progress
+    returns dict of probe: (pulse_durs, pulse_nums, weights)
+    """
+    if weigh is None and not can_ask():  # before any liquid is released
+        raise IOError('No terminal to type in the weights')
+    weigh = weigh if weigh else ask_weights
+    pulse_durs = sorted(pulse_durs)
+    weights = {probe: [] for probe in probes}
+    for pulse_dur in pulse_durs:
+        pacer = FramePacer(1000 / (pulse_dur + pulse_interval))
+        for pulse in range(pulse_num):
+            if display:
+                display('%d ms pulse %d/%d' % (pulse_dur, pulse + 1, pulse_num))
+            pacer.tick()
+            for probe in probes:
+                valve.give_liquid(probe, pulse_dur, False)     # pulses of all probes start together
+        time.sleep(pulse_dur / 1000)                            # let the last pulse finish
+        stats = pacer.stats()
+        print('%d ms: pulse interval %.1f +- %.1f ms, %d late' % (pulse_dur, stats['mean'], stats['std'], stats['late']))
+        if display:
+            display('Weigh %d ms' % pulse_dur)
+        for probe, weight in zip(probes, weigh(pulse_dur, probes)):
+            weights[probe].append(weight)
+    return {probe: (np.array(pulse_durs), np.full(len(pulse_durs), pulse_num), np.array(weights[probe]))
+            for probe in probes}
+
+
+def can_ask():
+    """ Whether an operator can type in the weights, Supervisor workers run with stdin at /dev/null """
+    return sys.stdin is not None and sys.stdin.isatty()
+
+
+def ask_weights(pulse_dur, probes):
+    """ Weights of the liquid released by each probe typed in by the operator """
+    if not can_ask():
+        raise IOError('No terminal to type in the weights')
+    return [float(input('Weight of probe %d for %d ms (gr): ' % (probe, pulse_dur))) for probe in probes]
+
+
+def fit(pulse_durs, pulse_nums, weights):
+    """ Linear fit of the weight per pulse on the pulse duration
+    returns (slope, intercept, r2)
+    """
+    per_pulse = np.divide(weights, pulse_nums)
+    slope, intercept = np.polyfit(pulse_durs, per_pulse, 1)
+    residual = np.sum((per_pulse - (slope * np.array(pulse_durs) + intercept)) ** 2)
+    total = np.sum((per_pulse - np.mean(per_pulse)) ** 2)
+    return slope, intercept, 1 - residual / total if total > 0 else 0
+
+
+def validate(pulse_durs, pulse_nums, weights, min_r2=0.9):
+    """ Problems of a calibration curve that would break the interpolation of Probe, empty if it is usable """
+    problems = []
+    per_pulse = np.divide(weights, pulse_nums)
+    if len(pulse_durs) < 2:
+        problems.append('less than 2 points')
+        return problems
+    if np.any(per_pulse <= 0):
+        problems.append('no liquid released at %s ms' % list(np.array(pulse_durs)[per_pulse <= 0]))
+    if np.any(np.diff(per_pulse) <= 0):
+        problems.append('weight does not increase with the pulse duration')
+    slope, intercept, r2 = fit(pulse_durs, pulse_nums, weights)
+    if slope <= 0 or r2 < min_r2:
+        problems.append('poor linear fit, slope %.2g gr/ms r2 %.2f' % (slope, r2))
+    return problems
+
+
+def save(setup, calibration, date=None):
+    """ Inserts the curves of all probes in one transaction, replacing the points of the same day """
+    date = date if date else time.strftime("%Y-%m-%d")
+    with LiquidCalibration.connection.transaction:
+        for probe, (pulse_durs, pulse_nums, weights) in calibration.items():
+            cal_key = dict(setup=setup, probe=probe, date=date)
+            LiquidCalibration().insert1(cal_key, skip_duplicates=True)
+            (LiquidCalibration.PulseWeight() & cal_key & [dict(pulse_dur=int(dur)) for dur in pulse_durs]).delete_quick()
+            LiquidCalibration.PulseWeight().insert([dict(cal_key, pulse_dur=int(dur), pulse_num=int(num), weight=weight)
+                                                    for dur, num, weight in zip(pulse_durs, pulse_nums, weights)])
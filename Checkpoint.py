@@ -0,0 +1,65 @@
+import os, json, time
+import numpy as np
+
+
+class Checkpoint:
+    """ This class keeps a snapshot of the live session state on local disk
+    a rig that restarts during a session resumes it from the snapshot instead of starting a new one.
+    The file is replaced atomically, so a crash while saving leaves the previous snapshot.
+    interval: minimum time between saves (s)
+    max_age: older snapshots are ignored (s)
+    """
+
+    def __init__(self, filename, interval=10, max_age=3600):
+        self.filename = os.path.expanduser(filename)
+        self.interval = interval
+        self.max_age = max_age
+        self.last_save = 0
+
+    def save(self, state, force=False):
+        """ Store the state if interval has passed since the last save, returns True if it was stored """
+        if not force and time.time() - self.last_save < self.interval:
+            return False
+        tmp_filename = '%s.%d.tmp' % (self.filename, os.getpid())
+        os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+        with open(tmp_filename, 'w') as f:
+            json.dump(dict(state, saved=time.time()), f, default=to_json)
+        os.replace(tmp_filename, self.filename)
+        self.last_save = time.time()
+        return True
+
+    def load(self):
+        """ The stored state or None if there is no recent snapshot """
+        if not os.path.isfile(self.filename):
+            return None
+        try:
+            with open(self.filename) as f:
+                state = json.load(f)
+        except ValueError:
+            print('Ignoring corrupted checkpoint %s' % self.filename)
+            return None
+        if time.time() - state.get('saved', 0) > self.max_age:
+            return None
+        return state
+
+    def clear(self):
+        """ Remove the snapshot when the session ends normally """
+        if os.path.isfile(self.filename):
+            os.remove(self.filename)
+        self.last_save = 0
+
+
+def get_checkpoint(logger):
+    """ Checkpoint of a setup, the checkpoint setup option sets the file, false disables it """
+    filename = logger.setup_conf.get('checkpoint', '~/.checkpoint_%s.json' % logger.setup)
+    if not filename:
+        return None
+    return Checkpoint(filename, logger.setup_conf.get('checkpoint_interval', 10),
+                      logger.setup_conf.get('checkpoint_max_age', 3600))
+
+
+def to_json(value):
+    """ Converts the numpy values of the state """
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    raise TypeError('%s is not serializable' % type(value).__name__)
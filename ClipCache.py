@@ -0,0 +1,175 @@
+import os, json, fcntl, hashlib, threading
+from concurrent.futures import ThreadPoolExecutor
+from Database import *
+
+
+class ClipCache:
+    """ This class handles a persistent local cache of movie clips
+    clips are stored by the sha256 of their content, so sessions & setups sharing the path share the files.
+    The cache is kept under max_bytes by evicting the least recently used clips.
+    Clips in the clip store are copied from it, the others are fetched from the database.
+    """
+
+    def __init__(self, path, max_bytes=10e9, max_workers=4, store=False):
+        self.path = path
+        self.store = store
+        self.max_bytes = max_bytes
+        self.max_workers = max_workers
+        self.index_file = os.path.join(path, 'index.json')   # clip key -> content hash
+        self.pinned = set()                                  # hashes in use by this process, never evicted
+        self.local = threading.local()
+        if not os.path.isdir(self.path):  # create path if necessary
+            os.makedirs(self.path)
+
+    def prefetch(self, keys, verify=True):
+        """ Make sure all clips are local, fetching the missing ones concurrently
+        keys: list of Movie.Clip primary keys
+        returns a list of the local filenames
+        """
+        filenames = [self.get(key, verify) for key in keys]
+        missing = [key for key, filename in zip(keys, filenames) if not filename]
+        if missing:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                fetched = dict(zip([self.__key(key) for key in missing], pool.map(self.__fetch, missing)))
+            filenames = [filename if filename else fetched[self.__key(key)] for key, filename in zip(keys, filenames)]
+        self.evict()
+        return filenames
+
+    def get(self, key, verify=False):
+        """ Return the local filename of a clip or False if it is not cached """
+        clip_hash = self.__read_index().get(self.__key(key))
+        if not clip_hash:
+            return False
+        filename = self.__filename(clip_hash)
+        if not os.path.isfile(filename) or not os.path.getsize(filename):  # empty clips were cached from purged blobs
+            return False
+        if verify and self.__hash_file(filename) != clip_hash['sha256']:
+            print('Removing corrupted clip %s' % filename)
+            os.remove(filename)
+            return False
+        os.utime(filename)  # mark as recently used
+        self.pinned.add(clip_hash['sha256'])
+        return filename
+
+    def put(self, key, clip, file_name=''):
+        """ Store a clip atomically and return its local filename """
+        data = clip.tobytes()
+        if not data:  # purged blob of a clip moved to the clip store, would be cached as a valid empty clip
+            raise IOError('Clip %s is empty' % self.__key(key))
+        clip_hash = dict(sha256=hashlib.sha256(data).hexdigest(), ext=os.path.splitext(file_name)[1])
+        filename = self.__filename(clip_hash)
+        if not os.path.isfile(filename):
+            tmp_filename = '%s.%d.%d.tmp' % (filename, os.getpid(), threading.get_ident())
+            with open(tmp_filename, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_filename, filename)
+        return self.__add(key, clip_hash)
+
+    def put_stored(self, key, sha256, ext):
+        """ Copy a clip from the clip store and return its local filename, the copy is verified against its hash """
+        clip_hash = dict(sha256=sha256, ext=ext)
+        filename = self.__filename(clip_hash)
+        if not os.path.isfile(filename):
+            self.store.copy(sha256, ext, filename, verify=True)
+        return self.__add(key, clip_hash)
+
+    def __add(self, key, clip_hash):
+        filename = self.__filename(clip_hash)
+        with self.__lock():
+            index = self.__read_index()
+            index[self.__key(key)] = clip_hash
+            self.__write_index(index)
+        self.pinned.add(clip_hash['sha256'])
+        return filename
+
+    def evict(self):
+        """ Remove least recently used clips until the cache fits in max_bytes """
+        with self.__lock():
+            evict(self.path, self.max_bytes, self.pinned)
+
+    def size(self):
+        return sum(os.path.getsize(os.path.join(self.path, name)) for name in os.listdir(self.path))
+
+    def __fetch(self, key):
+        """ Fetch a clip from the clip store or the database with a connection per thread """
+        if not hasattr(self.local, 'conn'):
+            self.local.conn = dj.Connection(dj.config['database.host'], dj.config['database.user'],
+                                            dj.config['database.password'])
+        stored = self.local.conn.query(
+            'SELECT sha256, file_format FROM %s WHERE movie_name=%%s AND clip_number=%%s' %
+            StoredClip.full_table_name, args=(key['movie_name'], key['clip_number'])).fetchone()
+        if stored:  # the blob may have been purged, so stored clips only come from the store
+            ext = '.' + stored[1] if stored[1] else ''
+            if not self.store or not self.store.exists(stored[0], ext):
+                raise IOError('Clip %s is not in the clip store %s' %
+                              (self.__key(key), self.store.root if self.store else ''))
+            return self.put_stored(key, stored[0], ext)
+        file_name, clip = self.local.conn.query(
+            'SELECT file_name, clip FROM %s WHERE movie_name=%%s AND clip_number=%%s' % Movie.Clip.full_table_name,
+            args=(key['movie_name'], key['clip_number'])).fetchone()
+        return self.put(key, dj.blob.unpack(clip), file_name)
+
+    def __filename(self, clip_hash):
+        return os.path.join(self.path, clip_hash['sha256'] + clip_hash['ext'])
+
+    def __key(self, key):
+        return '%s_%d' % (key['movie_name'], key['clip_number'])
+
+    def __hash_file(self, filename):
+        sha = hashlib.sha256()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def __read_index(self):
+        if not os.path.isfile(self.index_file):
+            return dict()
+        with open(self.index_file) as f:
+            return json.load(f)
+
+    def __write_index(self, index):
+        tmp_filename = '%s.%d.tmp' % (self.index_file, os.getpid())
+        with open(tmp_filename, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_filename, self.index_file)
+
+    def __lock(self):
+        return FileLock(os.path.join(self.path, 'cache.lock'))
+
+
+def evict(path, max_bytes, pinned=()):
+    """ Remove the least recently used files of a cache folder until it fits in max_bytes
+    files are named by their hash and files whose hash is pinned are kept
+    """
+    files = [os.path.join(path, name) for name in os.listdir(path)
+             if not name.startswith('index') and not name.endswith(('.tmp', '.lock'))]
+    files = sorted(files, key=os.path.getmtime)
+    total = sum(os.path.getsize(file) for file in files)
+    for file in files:
+        if total <= max_bytes:
+            break
+        if os.path.splitext(os.path.basename(file))[0] in pinned:
+            continue
+        total -= os.path.getsize(file)
+        os.remove(file)
+
+
+class FileLock:
+    """ Exclusive lock shared between processes & threads """
+
+    thread_lock = threading.Lock()
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        self.file = open(self.filename, 'w')
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+        self.thread_lock.release()
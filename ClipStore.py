@@ -0,0 +1,92 @@
+import os, hashlib, threading
+import numpy as np
+
+
+class ClipStore:
+    """ This class handles a content addressed file store of movie clips outside of the database
+    clips are stored as root/ab/cd/<sha256><ext>, the database only keeps their hash, size & format in StoredClip.
+    Any shared or local filesystem works, e.g. a local folder for testing.
+    """
+
+    def __init__(self, root='/mnt/clips/'):
+        self.root = root
+
+    def path(self, sha256, ext=''):
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256 + ext)
+
+    def exists(self, sha256, ext=''):
+        return os.path.isfile(self.path(sha256, ext))
+
+    def put(self, source, ext=''):
+        """ Store a clip from a file name or bytes, returns its sha256 & size """
+        sha = hashlib.sha256()
+        tmp_filename = os.path.join(self.root, 'tmp.%d.%s' % (os.getpid(), hashlib.sha1(os.urandom(8)).hexdigest()))
+        os.makedirs(self.root, exist_ok=True)
+        with open(tmp_filename, 'wb') as f:
+            if isinstance(source, str):
+                with open(source, 'rb') as src:
+                    for chunk in iter(lambda: src.read(1 << 20), b''):
+                        sha.update(chunk)
+                        f.write(chunk)
+            else:
+                sha.update(source)
+                f.write(source)
+            size = f.tell()
+        sha256 = sha.hexdigest()
+        if self.exists(sha256, ext):  # same content is stored once
+            os.remove(tmp_filename)
+        else:
+            os.makedirs(os.path.dirname(self.path(sha256, ext)), exist_ok=True)
+            os.replace(tmp_filename, self.path(sha256, ext))
+        return sha256, size
+
+    def open(self, sha256, ext=''):
+        """ Binary file handle of a clip for streaming """
+        return open(self.path(sha256, ext), 'rb')
+
+    def memmap(self, sha256, ext=''):
+        """ Read only uint8 memory map of a clip """
+        return np.memmap(self.path(sha256, ext), dtype=np.uint8, mode='r')
+
+    def copy(self, sha256, ext, filename, verify=False):
+        """ Copy a clip to a local file atomically
+        verify: hash the copy and raise an IOError instead of replacing the file if it does not match
+        """
+        tmp_filename = '%s.%d.%d.tmp' % (filename, os.getpid(), threading.get_ident())
+        sha = hashlib.sha256()
+        with self.open(sha256, ext) as src, open(tmp_filename, 'wb') as f:
+            for chunk in iter(lambda: src.read(1 << 20), b''):
+                if verify:
+                    sha.update(chunk)
+                f.write(chunk)
+        if verify and sha.hexdigest() != sha256:
+            os.remove(tmp_filename)
+            raise IOError('Stored clip %s does not match its hash' % self.path(sha256, ext))
+        os.replace(tmp_filename, filename)
+        return filename
+
+    def verify(self, sha256, ext=''):
+        sha = hashlib.sha256()
+        with self.open(sha256, ext) as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+        return sha.hexdigest() == sha256
+
+
+def migrate_clips(store, restriction=dict(), purge=False):
+    """ Moves the Movie.Clip blobs to the clip store one clip at a time
+    purge: replace the stored blobs with empty ones once the file is verified
+    """
+    from Database import Movie, StoredClip
+    keys = ((Movie.Clip() & restriction) - StoredClip()).fetch('KEY')
+    print('Migrating %d clips to %s' % (len(keys), store.root))
+    for key in keys:
+        file_name, clip = (Movie.Clip() & key).fetch1('file_name', 'clip')
+        ext = os.path.splitext(file_name)[1]
+        sha256, size = store.put(clip.tobytes(), ext)
+        if not store.verify(sha256, ext):
+            raise IOError('Stored clip %s does not match its hash' % store.path(sha256, ext))
+        StoredClip().insert1(dict(key, sha256=sha256, size=size, file_format=ext.lstrip('.')))
+        if purge:
+            (Movie.Clip() & key)._update('clip', np.zeros(0, dtype=np.uint8))
+        print('%s %d: %d bytes' % (key['movie_name'], key['clip_number'], size))
@@ -0,0 +1,121 @@
+import json, struct, socket, threading, socketserver
+from queue import Queue, Empty
+
+# Commands from 2pMaster to ExpControl over TCP, the SetupControl table remains as a fallback
+# each message is a 4 byte big endian length followed by a utf-8 json object
+# requests:  {"command": "startStim"}, commands are the state_control values of SetupControl
+# replies:   {"ack": "startStim", "state": "sessionRunning"} on receipt, with the state at that time
+#            {"state": "stimRunning"} to every client on each state transition
+#            {"error": "..."} for malformed messages or unknown commands
+# clients that do not read their replies within send_timeout are disconnected
+COMMAND_PORT = 5557
+COMMANDS = ('startSession', 'startStim', 'stopStim', 'stopSession', 'Initialize')  # handled by ExpControl
+
+
+def send_message(sock, message):
+    data = json.dumps(message).encode()
+    sock.sendall(struct.pack('>I', len(data)) + data)
+
+
+def recv_message(sock):
+    """ Read one message, returns None when the connection is closed """
+    header = _recv_exactly(sock, 4)
+    if header is None:
+        return None
+    data = _recv_exactly(sock, struct.unpack('>I', header)[0])
+    return None if data is None else json.loads(data.decode())
+
+
+def _recv_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+class CommandServer:
+    """ This class receives commands in a background thread and queues them for the control loop """
+
+    def __init__(self, port=COMMAND_PORT, host='127.0.0.1', send_timeout=0.2):
+        self.commands = Queue()
+        self.clients = dict()       # client socket: lock of its sends
+        self.lock = threading.Lock()  # guards clients only, sends are not made under it
+        self.state = None
+        server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                seconds = int(send_timeout)
+                self.request.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO,  # sends only, reads stay blocking
+                                        struct.pack('ll', seconds, int((send_timeout - seconds) * 1e6)))
+                with server.lock:
+                    server.clients[self.request] = threading.Lock()
+                try:
+                    while True:
+                        try:
+                            message = recv_message(self.request)
+                        except ValueError:
+                            server.send(self.request, dict(error='malformed message'))
+                            continue
+                        if message is None:
+                            break
+                        command = message.get('command') if isinstance(message, dict) else None
+                        if command not in COMMANDS:
+                            server.send(self.request, dict(error='unknown command %s' % command))
+                            continue
+                        server.send(self.request, dict(ack=command, state=server.state))
+                        server.commands.put(command)
+                except OSError:
+                    pass
+                finally:
+                    with server.lock:
+                        server.clients.pop(self.request, None)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def get(self, timeout=0):
+        """ Next command, waiting up to timeout (s), None if there is none """
+        try:
+            return self.commands.get(timeout=timeout) if timeout > 0 else self.commands.get_nowait()
+        except Empty:
+            return None
+
+    def broadcast_state(self, state):
+        """ Report a state transition to all clients """
+        self.state = state
+        with self.lock:
+            clients = list(self.clients)
+        for client in clients:
+            self.send(client, dict(state=state))
+
+    def send(self, client, message):
+        """ Send to one client, a client that fails or times out is dropped as its stream may be cut mid message """
+        with self.lock:
+            client_lock = self.clients.get(client)
+        if client_lock is None:
+            return
+        try:
+            with client_lock:
+                send_message(client, message)
+        except OSError:
+            self.drop(client)
+
+    def drop(self, client):
+        with self.lock:
+            self.clients.pop(client, None)
+        try:
+            client.shutdown(socket.SHUT_RDWR)  # ends the handler of the client
+        except OSError:
+            pass
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -120,6 +120,18 @@ class CalibrationTask(dj.Lookup):
     """
 
 
+@schema
+class CalibrationSweep(dj.Lookup):
+    definition = """
+    # Multi point calibration, replaces the pulse_dur of the task with a list of durations
+    -> CalibrationTask
+    ---
+    pulse_durs='[20,40,60,80,100]' : varchar(256)  # durations of pulses in ms
+    probe_control='RPProbe'      : varchar(128)    # valve control class
+    min_r2=0.9                   : float           # minimum r2 of the linear fit of a valid curve
+    """
+
+
 @schema
 class MouseWeight(dj.Manual):
     definition = """
@@ -174,6 +186,54 @@ class Trial(dj.Manual):
     """
 
 
+@schema
+class FlipStats(dj.Manual):
+    definition = """
+    # Flip timing of each trial
+    -> Trial
+    ---
+    flips                    : int             # number of flips in the trial
+    dropped_frames           : int             # frames missed against the target interval
+    target_ifi               : float           # target inter-flip interval (ms)
+    ifi_mean                 : float           # mean inter-flip interval (ms)
+    ifi_std                  : float           # std of the inter-flip interval (ms)
+    ifi_min                  : float           # min inter-flip interval (ms)
+    ifi_max                  : float           # max inter-flip interval (ms)
+    ifi_p50                  : float           # median inter-flip interval (ms)
+    ifi_p95                  : float           # 95th percentile of the inter-flip interval (ms)
+    ifi_p99                  : float           # 99th percentile of the inter-flip interval (ms)
+    flip_times=null          : longblob        # flip times from session start (ms)
+    """
+
+
+@schema
+class RewardLatency(dj.Manual):
+    definition = """
+    # Latency of the rewarded licks of a session along the reward path, see Trace
+    -> Session
+    hop                  : varchar(32)     # hop of the reward path or total from lick to valve
+    ---
+    events               : int             # number of rewarded licks
+    dropped=0            : int             # rewarded licks not traced, beyond the trace_events setup option
+    p50                  : float           # median latency (ms)
+    p95                  : float           # 95th percentile (ms)
+    p99                  : float           # 99th percentile (ms)
+    max                  : float           # maximum latency (ms)
+    """
+
+
+@schema
+class PlayerOnset(dj.Manual):
+    definition = """
+    # Movie player onset of each trial
+    -> Trial
+    ---
+    spawn_time               : float           # player process spawn & DBus handshake time (ms)
+    onset_latency            : float           # play command to first frame latency (ms)
+    preloaded                : tinyint         # player was loaded before the trial (binary)
+    """
+
+
 @schema
 class Lick(dj.Manual):
     definition = """
@@ -184,6 +244,19 @@ class Lick(dj.Manual):
     """
 
 
+@schema
+class TrialLicks(dj.Manual):
+    definition = """
+    # Licks of each trial packed per probe, from the end of the previous trial to the end of the trial
+    -> Trial
+    ---
+    lick_count               : int             # number of licks
+    probes                   : blob            # probe numbers with licks
+    probe_licks              : blob            # number of licks of each probe
+    lick_times               : longblob        # delta encoded times (int32 ms) concatenated by probe, each from the trial start
+    """
+
+
 @schema
 class LiquidDelivery(dj.Manual):
     definition = """
@@ -237,6 +310,17 @@ class Movie(dj.Lookup):
         clip                 : longblob                     #
         """
 
+@schema
+class StoredClip(dj.Manual):
+    definition = """
+    # Movie clips in the external clip store, see ClipStore
+    -> Movie.Clip
+    ---
+    sha256                   : char(64)        # content hash, names the file in the store
+    size                     : bigint          # file size (bytes)
+    file_format              : varchar(8)      # container file extension, the encoding is in Movie.codec
+    """
+
 @schema
 class MovieClipCond(dj.Manual):
     definition = """
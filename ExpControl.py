@@ -1,6 +1,8 @@
 
 from Logger import *
-from Experiment import *
+from Registry import get_experiment
+from CommandServer import CommandServer, COMMAND_PORT
+from Checkpoint import get_checkpoint
 
 
 class ExpControl:
@@ -13,7 +15,39 @@ class ExpControl:
         self.logger = logger
         self.logger.setup_experiment_schema()
         self.prev_command = None
-        self.logger.update_setup_state('systemReady')
+        self.state_control = None
+        self.poll_interval = self.logger.setup_conf.get('control_poll_interval', 0.1)  # SetupControl fallback (s)
+        self.last_poll = 0
+        self.server = None
+        self.checkpoint = get_checkpoint(self.logger)  # live session state on local disk
+        self.state = None                              # checkpoint of the session being resumed
+        if self.logger.setup_conf.get('command_port', COMMAND_PORT):
+            try:
+                self.server = CommandServer(self.logger.setup_conf.get('command_port', COMMAND_PORT),
+                                            self.logger.setup_conf.get('command_host', '127.0.0.1'))
+            except OSError:
+                print('Command port is in use, polling SetupControl only')
+        self.update_state('systemReady')
+
+    def get_state_control(self, timeout=0):
+        """ Current command, from the command server or from SetupControl at a low rate
+        timeout: time to wait for a command from the server (s)
+        """
+        command = self.server.get(timeout) if self.server else None
+        if command is not None:
+            self.state_control = command
+            self.logger.update_setup_state_control(command)  # keep the fallback path consistent
+        elif self.state_control is None or systime.time() - self.last_poll > self.poll_interval:
+            if timeout > 0 and not self.server:
+                systime.sleep(timeout)
+            self.state_control = self.logger.get_setup_state_control()
+            self.last_poll = systime.time()
+        return self.state_control
+
+    def update_state(self, state):
+        self.logger.update_setup_state(state)
+        if self.server:
+            self.server.broadcast_state(state)
 
     def do_run_trial(self):
 #       self.timer.start()
@@ -25,7 +59,7 @@ class ExpControl:
         # # # # # Trial period # # # # #
         self.timer.start()  # Start countdown for response]
         while self.timer.elapsed_time() < self.params['trial_duration'] * 1000 and \
-                        self.logger.get_setup_state_control() == 'startStim' and self.exprmt.run():  # response period
+                        self.get_state_control() == 'startStim' and self.exprmt.run():  # response period
             break_trial = self.exprmt.trial()  #  return true if trial is done
             if break_trial:
                 break  # break if experiment calls for it
@@ -35,9 +69,11 @@ class ExpControl:
 
         # # # # # Post-Trial Period # # # # #
         self.exprmt.post_trial()
+        self.save_checkpoint()
 
         # # # # # Intertrial period # # # # #
-        while self.timer.elapsed_time() < self.params['intertrial_duration'] * 1000:
+        while self.timer.elapsed_time() < self.params['intertrial_duration'] * 1000 and \
+                self.get_state_control() == 'startStim':
             self.exprmt.inter_trial()
 
     def do_initialize(self):
@@ -49,24 +85,33 @@ class ExpControl:
                 self.do_stop_stim()
             else:
                 pass
-            self.logger.update_setup_state('systemReady')
+            self.update_state('systemReady')
 
     def do_start_session(self):
         """start stimulation session"""
         if not self.logger.get_setup_state() == 'sessionRunning':
             self.logger.init_params()  # clear settings from previous session
-            self.logger.log_session()  # start session
-            self.logger.update_setup_state('sessionRunning')
+            self.state = self.checkpoint.load() if self.checkpoint else None
+            if self.state is None or not self.logger.resume_session(self.state):
+                self.state = None
+                self.logger.log_session()  # start session
+            self.update_state('sessionRunning')
             self.params = (Task() & dict(task_idx=self.logger.task_idx)).fetch1()  # get parameters
             self.timer = Timer()  # main timer for trials
-            self.exprmt = eval(self.params['exp_type'])(self.logger, self.timer, self.params)  # get experiment & init
+            self.exprmt = get_experiment(self.params['exp_type'])(self.logger, self.timer, self.params)  # get experiment & init
 
     def do_start_stim(self):
         """start stimulation trials"""
         if not self.logger.get_setup_state() == 'stimRunning':
-            self.exprmt.prepare()  # open stimulus window and prepare the protocol
-            self.logger.update_setup_state('stimRunning')
-            while self.logger.get_setup_state_control() == 'startStim' and self.exprmt.run():
+            if self.state is not None:  # restore the protocol of the interrupted session
+                print('Resuming session %d' % self.logger.session_key['session_id'])
+                self.exprmt.resume(self.state)
+                self.state = None
+            else:
+                self.exprmt.prepare()  # open stimulus window and prepare the protocol
+            self.save_checkpoint(force=True)
+            self.update_state('stimRunning')
+            while self.get_state_control() == 'startStim' and self.exprmt.run():
                 self.logger.ping()
                 self.do_run_trial()
             if not self.exprmt.run():  # stop if trials ended
@@ -76,12 +121,18 @@ class ExpControl:
         # # # # # Cleanup # # # # #
         if self.logger.get_setup_state() == 'stimRunning':
             self.exprmt.cleanup()  # close the window and cleanup after the protocol run
-            self.logger.update_setup_state('sessionRunning')
+            self.update_state('sessionRunning')
 
     def do_stop_session(self):
         if self.logger.get_setup_state() == 'sessionRunning' or self.logger.get_setup_state() == 'stimRunning':
             self.do_stop_stim()  # first stop the stimulaton
-            self.logger.update_setup_state('systemReady')
+            self.update_state('systemReady')
+            if self.checkpoint:
+                self.checkpoint.clear()  # session ended, start a new one next time
+
+    def save_checkpoint(self, force=False):
+        if self.checkpoint:
+            self.checkpoint.save(dict(self.logger.get_state(), **self.exprmt.get_state()), force)
 
     def process_command(self, command):
         if not command == self.prev_command:  # only process changes in command
@@ -1,6 +1,8 @@
-from Behavior import *
-from Stimulus import *
+from Database import *
+from Timer import *
+from Registry import get_behavior, get_stimulus
 import time, numpy
+import numpy as np
 
 
 class Experiment:
@@ -20,14 +22,40 @@ class Experiment:
         self.probes = []
         self.post_wait = 0
         self.indexes = []
-        self.beh = self.get_behavior()(logger, params)
-        self.stim = eval(params['stim_type'])(logger, self.beh)
+        self.next_cond = None
+        self.beh = get_behavior(self.get_behavior())(logger, params)
+        self.stim = get_stimulus(params['stim_type'])(logger, self.beh)
         self.probe_bias = numpy.repeat(numpy.nan, 1)   # History term for bias calculation
 
     def prepare(self):
         """Prepare things before experiment starts"""
         self.stim.setup()
 
+    def resume(self, state):
+        """Continue a session from a checkpoint instead of preparing it again"""
+        if not len(state['conditions']):  # nothing to restore
+            self.prepare()
+            return
+        self.conditions, self.probes = numpy.array(state['conditions']), numpy.array(state['probes'])
+        self.indexes = numpy.array(state['indexes'], dtype=int)
+        self.probe_bias = numpy.array(state['probe_bias'], dtype=float)
+        self.stim.setup()
+        self.stim.resume(self.conditions, state['manifest'])
+        self.next_cond = state['next_cond']
+        if self.next_cond is not None:
+            self.stim.load_trial(self.next_cond)
+        else:
+            self._schedule_next_cond()
+
+    def get_state(self):
+        """Schedule & stimulus state stored in checkpoints"""
+        return dict(conditions=self.conditions,
+                    probes=self.probes,
+                    indexes=self.indexes,
+                    next_cond=self.next_cond,
+                    probe_bias=self.probe_bias,
+                    manifest=self.stim.get_manifest())
+
     def run(self):
         return self.logger.get_setup_state() == 'running'
 
@@ -55,10 +83,12 @@ class Experiment:
         pass
 
     def cleanup(self):
+        self.logger.log_latency()
         self.beh.cleanup()
+        self.stim.cleanup()
 
     def get_behavior(self):
-        return DummyProbe  # default is raspberry pi
+        return 'DummyProbe'  # default is raspberry pi
 
     def _get_new_cond(self):
         """Get curr condition & create random block of all conditions
@@ -83,6 +113,17 @@ class Experiment:
                 bias_probe = numpy.random.binomial(1, 1 - numpy.nanmean((self.probe_bias - mn)/(mx-mn)))*(mx-mn) + mn
                 return numpy.random.choice(self.conditions[self.probes == bias_probe])
 
+    def _schedule_next_cond(self):
+        """Pick the condition of the next trial so that the stimulus can preload it during the intertrial"""
+        self.next_cond = self._get_new_cond()
+        self.stim.load_trial(self.next_cond)
+
+    def _next_cond(self):
+        """Get the scheduled condition, or a new one if none is scheduled"""
+        cond = self.next_cond if self.next_cond is not None else self._get_new_cond()
+        self.next_cond = None
+        return cond
+
 
 class MultiProbe(Experiment):
     """2AFC & GoNOGo tasks with lickspout"""
@@ -96,9 +137,10 @@ class MultiProbe(Experiment):
         self.conditions, self.probes = self.logger.log_conditions(self.stim.get_condition_table())  # log conditions
         self.stim.setup()
         self.stim.prepare(self.conditions)  # prepare stimulus
+        self._schedule_next_cond()
 
     def pre_trial(self):
-        cond = self._get_new_cond()
+        cond = self._next_cond()
         self.stim.init_trial(cond)
         self.reward_probe = (RewardCond() & self.logger.session_key & dict(cond_idx=cond)).fetch1('probe')
         self.beh.is_licking()
@@ -112,6 +154,7 @@ class MultiProbe(Experiment):
             self.probe_bias = np.concatenate((self.probe_bias[1:], [probe])) # bias correction
             if self.reward_probe == probe:
                 print('Correct!')
+                self.logger.trace.mark('experiment')
                 self.reward(probe)
                 self.timer.start()
                 while self.timer.elapsed_time() < 1000:  # give an extra second to associate the reward with stimulus
@@ -134,6 +177,7 @@ class MultiProbe(Experiment):
             time.sleep(0.5)
         self.post_wait = 0
         self.stim.unshow()
+        self._schedule_next_cond()
 
     def inter_trial(self):
         if self.beh.is_licking():
@@ -165,13 +209,14 @@ class FreeWater(Experiment):
         self.stim.present_trial()  # Start Stimulus
         probe = self.beh.is_licking()
         if probe:
+            self.logger.trace.mark('experiment')
             self.beh.water_reward(probe)
             return True
         else:
             return False
 
     def get_behavior(self):
-        return RPBehavior
+        return 'RPBehavior'
 
 
 class PassiveMatlab(Experiment):
@@ -196,6 +241,7 @@ class PassiveMatlab(Experiment):
         return self.logger.get_setup_state() == 'stimRunning' and not self.stim.stimulus_done()
 
     def cleanup(self):
+        self.logger.log_latency()
         self.beh.cleanup()
         self.stim.cleanup()
         self.stim.close()
@@ -214,14 +260,14 @@ class PassiveMatlabReward(PassiveMatlab):
                 self.beh.water_reward(1)
 
     def get_behavior(self):
-        return TPBehavior
+        return 'TPBehavior'
 
 
 class ActiveMatlab(Experiment):
     """ Rewarded conditions with Matlab
     """
     def __init__(self, logger, timer, params):
-        self.stim = eval(params['stim_type'])(logger, self.get_behavior())
+        self.stim = get_stimulus(params['stim_type'])(logger, get_behavior(self.get_behavior()))
         super(ActiveMatlab, self).__init__(logger, timer, params)
 
     def prepare(self):
@@ -239,11 +285,12 @@ class ActiveMatlab(Experiment):
         if probe > 0:
             if self.reward_probe == probe:
                 print('Correct!')
+                self.logger.trace.mark('experiment')
                 self.reward(probe)
         return self.stim.trial.done()
 
     def get_behavior(self):
-        return SerialProbe
+        return 'SerialProbe'
 
     def run(self):
         return self.logger.get_setup_state() == 'stimRunning' and not self.stim.stimulus_done()
@@ -252,6 +299,7 @@ class ActiveMatlab(Experiment):
         self.beh.water_reward(probe)
 
     def cleanup(self):
+        self.logger.log_latency()
         self.beh.cleanup()
         self.stim.cleanup()
         self.stim.close()
@@ -270,9 +318,10 @@ class CenterPort(Experiment):
         self.conditions, self.probes = self.logger.log_conditions(self.stim.get_condition_table())  # log conditions
         self.stim.setup()
         self.stim.prepare(self.conditions)  # prepare stimulus
+        self._schedule_next_cond()
 
     def pre_trial(self):
-        cond = self._get_new_cond()
+        cond = self._next_cond()
         self.reward_probe = (RewardCond() & self.logger.session_key & dict(cond_idx=cond)).fetch1('probe')
         is_ready, ready_time = self.beh.is_ready()
         self.wait_time.start()
@@ -314,6 +363,7 @@ class CenterPort(Experiment):
                 self.punish(probe)
             else:
                 print('Correct!')
+                self.logger.trace.mark('experiment')
                 self.reward(probe)
             self.probe_bias = np.concatenate((self.probe_bias[1:], [probe]))
             self.resp_ready = False
@@ -330,13 +380,14 @@ class CenterPort(Experiment):
             time.sleep(0.5)
         self.post_wait = 0
         self.stim.unshow()
+        self._schedule_next_cond()
 
     def inter_trial(self):
         if self.beh.is_licking():
             self.timer.start()
 
     def get_behavior(self):
-        return RPBehavior
+        return 'RPBehavior'
 
     def punish(self, probe):
         self.post_wait = self.timeout
@@ -347,7 +398,7 @@ class CenterPort(Experiment):
 
 class DummyCenterPort(CenterPort):
     def get_behavior(self):
-        return DummyProbe
+        return 'DummyProbe'
 
 
 class CenterPortTrain(CenterPort):
@@ -370,6 +421,7 @@ class CenterPortTrain(CenterPort):
         # response to probe lick
         if probe > 0 and self.resp_ready:
             print('Correct!')
+            self.logger.trace.mark('experiment')
             self.reward(probe)
             self.resp_ready = False
             return True  # break trial
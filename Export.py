@@ -0,0 +1,125 @@
+import os, json, shutil
+import numpy as np
+from Database import *
+
+# # # # Columnar export of completed sessions # # # # #
+# each session is a folder root/<animal_id>/<session_id>/ with one .npy file per column of each table
+# and a manifest.json of the tables, their row counts & column types, so that the columns can be memory mapped.
+# root/export.json keeps the last exported session of each animal, re-runs only export the newer sessions.
+TABLES = ('Trial', 'Lick', 'LiquidDelivery', 'AirpuffDelivery', 'OdorDelivery', 'RewardCond')
+ORDER = dict(Trial='trial_idx', RewardCond='cond_idx')  # other tables are ordered by time
+SESSION_FIELDS = ('animal_id', 'session_id')
+RUNNING_STATES = ('running', 'sleeping', 'offtime')
+
+
+def session_path(root, key):
+    return os.path.join(root, str(key['animal_id']), str(key['session_id']))
+
+
+def export(root, restriction=dict(), tables=TABLES):
+    """ Exports the completed sessions after the high water mark of each animal
+    sessions running on a setup are left for the next run
+    """
+    marks = read_marks(root)
+    running = set((row.get('animal_id'), row.get('current_session')) for row in SetupInfo().fetch(as_dict=True)
+                  if row.get('state') in RUNNING_STATES)
+    keys = (Session() & restriction).fetch('KEY', order_by=SESSION_FIELDS)
+    print('Exporting to %s' % root)
+    for key in keys:
+        animal_id = str(key['animal_id'])
+        if key['session_id'] <= marks.get(animal_id, 0):
+            continue
+        if (key['animal_id'], key['session_id']) in running:
+            continue
+        rows = export_session(root, key, tables)
+        marks[animal_id] = int(key['session_id'])
+        write_marks(root, marks)
+        print('animal %d session %d: %s' % (key['animal_id'], key['session_id'],
+                                            ', '.join('%d %s' % (n, table) for table, n in rows.items())))
+
+
+def export_session(root, key, tables=TABLES):
+    """ Writes the tables of a session to its folder, replacing a previous export
+    returns dict of table: number of rows
+    """
+    path = session_path(root, key)
+    tmp_path = path + '.%d.tmp' % os.getpid()
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    manifest = dict(key=dict((field, int(key[field])) for field in SESSION_FIELDS), tables=dict())
+    for name in tables:
+        table = globals()[name]()
+        data = (table & key).fetch(order_by=ORDER.get(name, 'time'))  # structured array with the column types
+        os.makedirs(os.path.join(tmp_path, name))
+        columns = dict()
+        for field in data.dtype.names:
+            if field in SESSION_FIELDS:
+                continue
+            values = data[field]
+            if values.dtype == object:  # strings become fixed width, blobs are not exported
+                values = np.array(values.tolist())
+                if values.dtype == object:
+                    continue
+            np.save(os.path.join(tmp_path, name, field + '.npy'), values)
+            columns[field] = values.dtype.str
+        manifest['tables'][name] = dict(rows=len(data), columns=columns)
+    with open(os.path.join(tmp_path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    return dict((name, table['rows']) for name, table in manifest['tables'].items())
+
+
+def read_marks(root):
+    filename = os.path.join(root, 'export.json')
+    if not os.path.isfile(filename):
+        return dict()
+    with open(filename) as f:
+        return json.load(f)
+
+
+def write_marks(root, marks):
+    os.makedirs(root, exist_ok=True)
+    filename = os.path.join(root, 'export.json')
+    tmp_filename = '%s.%d.tmp' % (filename, os.getpid())
+    with open(tmp_filename, 'w') as f:
+        json.dump(marks, f, indent=1)
+    os.replace(tmp_filename, filename)
+
+
+def exported_sessions(root, animal_ids=None):
+    """ Keys of the exported sessions, sorted """
+    keys = []
+    for animal in os.listdir(root) if os.path.isdir(root) else []:
+        if not animal.isdigit() or (animal_ids is not None and int(animal) not in animal_ids):
+            continue
+        for session in os.listdir(os.path.join(root, animal)):
+            if session.isdigit() and os.path.isfile(os.path.join(root, animal, session, 'manifest.json')):
+                keys.append(dict(animal_id=int(animal), session_id=int(session)))
+    return sorted(keys, key=lambda key: (key['animal_id'], key['session_id']))
+
+
+def load_session(root, key, tables=TABLES):
+    """ Memory mapped columns of an exported session, dict of table: dict of column: array """
+    path = session_path(root, key)
+    with open(os.path.join(path, 'manifest.json')) as f:
+        manifest = json.load(f)
+    return dict((name, dict((column, np.load(os.path.join(path, name, column + '.npy'), mmap_mode='r'))
+                            for column in manifest['tables'][name]['columns']))
+                for name in tables if name in manifest['tables'])
+
+
+def load_cohort(root, animal_ids=None, tables=TABLES):
+    """ Columns of all exported sessions of the animals concatenated, with animal_id & session_id columns """
+    sessions = [(key, load_session(root, key, tables)) for key in exported_sessions(root, animal_ids)]
+    cohort = dict()
+    for name in tables:
+        parts = [(key, data[name]) for key, data in sessions if name in data]
+        if not parts:
+            continue
+        columns = set.intersection(*[set(columns) for key, columns in parts])
+        rows = [len(next(iter(columns.values()))) if columns else 0 for key, columns in parts]
+        cohort[name] = dict((column, np.concatenate([columns[column] for key, columns in parts]))
+                            for column in columns)
+        for field in SESSION_FIELDS:
+            cohort[name][field] = np.repeat([key[field] for key, columns in parts], rows)
+    return cohort
@@ -0,0 +1,147 @@
+import os, sys, json, time, socket, threading, socketserver
+from collections import deque
+
+# # # # Fleet status aggregator # # # # #
+# reads SetupInfo of all setups with one query per interval and serves the derived status from memory,
+# so the database load does not grow with the number of viewers:
+#   clients connecting to FLEET_PORT on localhost receive the latest snapshot as one json line
+#   the snapshot file is replaced atomically on every update, e.g. for the matlab plots
+# python FleetStatus.py [interval] [snapshot file]
+FLEET_PORT = 5558
+RUNNING_STATES = ('running', 'sleeping', 'offtime')
+
+
+def fleet_status(rows, history, now, stale_after=60, window=3600):
+    """ Derived status of the setups from their SetupInfo rows
+    history: dict of setup: deque of (time, session, last_trial), updated in place
+    returns dict with the status of each setup and the fleet totals
+    """
+    setups = dict()
+    for row in rows:
+        setup = row['setup']
+        last_ping = row.get('last_ping')
+        age = now - last_ping.timestamp() if hasattr(last_ping, 'timestamp') else None
+        session, last_trial = row.get('current_session'), row.get('last_trial') or 0
+
+        # trials per hour of the current session over the last window
+        samples = history.setdefault(setup, deque())
+        if samples and samples[-1][1] != session:
+            samples.clear()
+        samples.append((now, session, last_trial))
+        while len(samples) > 2 and now - samples[1][0] > window:
+            samples.popleft()
+        elapsed = samples[-1][0] - samples[0][0]
+        rate = 3600 * (samples[-1][2] - samples[0][2]) / elapsed if elapsed > 0 else 0
+
+        setups[setup] = dict(state=row.get('state'),
+                             animal_id=row.get('animal_id'),
+                             task_idx=row.get('task_idx'),
+                             session=session,
+                             last_trial=last_trial,
+                             trials_per_hour=rate,
+                             total_liquid=row.get('total_liquid') or 0,
+                             heartbeat_age=age,
+                             stale=age is None or age > stale_after,
+                             ip=row.get('ip'),
+                             notes=row.get('notes'))
+    for setup in set(history) - set(setups):  # removed setups
+        del history[setup]
+
+    liquid = dict()
+    for status in setups.values():
+        if status['animal_id'] is not None:
+            liquid[status['animal_id']] = liquid.get(status['animal_id'], 0) + status['total_liquid']
+    states = dict()
+    for status in setups.values():
+        states[status['state']] = states.get(status['state'], 0) + 1
+    return dict(time=now,
+                setups=setups,
+                states=states,
+                running=sum(status['state'] in RUNNING_STATES for status in setups.values()),
+                stale=sorted(setup for setup, status in setups.items()
+                             if status['stale'] and status['state'] in RUNNING_STATES),
+                trials_per_hour=sum(status['trials_per_hour'] for status in setups.values()),
+                animal_liquid=liquid,
+                total_liquid=sum(liquid.values()))
+
+
+class FleetAggregator:
+    """ This class polls SetupInfo at a fixed interval & serves the fleet status to local clients
+    stale_after: time without a ping after which a running setup is reported as stale (s)
+    """
+
+    def __init__(self, interval=5, port=FLEET_PORT, filename='/tmp/fleet_status.json', stale_after=60,
+                 host='127.0.0.1'):
+        self.interval = interval
+        self.filename = filename
+        self.stale_after = stale_after
+        self.history = dict()
+        self.status = dict()
+        self.message = b'{}\n'  # serialized once per update, clients only read it
+        self.server = None
+        if port:
+            aggregator = self
+
+            class Handler(socketserver.BaseRequestHandler):
+                def handle(self):
+                    try:
+                        self.request.sendall(aggregator.message)
+                    except OSError:
+                        pass
+
+            socketserver.ThreadingTCPServer.allow_reuse_address = True
+            self.server = socketserver.ThreadingTCPServer((host, port), Handler)
+            self.server.daemon_threads = True
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def update(self, rows=None):
+        """ One query for all setups, unless the rows are given """
+        if rows is None:
+            from Database import SetupInfo
+            rows = SetupInfo().fetch(as_dict=True)
+        self.status = fleet_status(rows, self.history, time.time(), self.stale_after)
+        self.message = (json.dumps(self.status, default=str) + '\n').encode()
+        if self.filename:
+            tmp_filename = '%s.%d.tmp' % (self.filename, os.getpid())
+            with open(tmp_filename, 'wb') as f:
+                f.write(self.message)
+            os.replace(tmp_filename, self.filename)
+        return self.status
+
+    def run(self):
+        while True:
+            tic = time.time()
+            try:
+                self.report(self.update())
+            except Exception as error:  # keep serving the last snapshot if the database is unreachable
+                print('Fleet update failed: %s' % error)
+            time.sleep(max(self.interval - (time.time() - tic), 0))
+
+    def report(self, status):
+        print('%s  %d setups, %d running, %.0f trials/h, %.2f ml%s' % (
+            time.strftime('%H:%M:%S'), len(status['setups']), status['running'], status['trials_per_hour'],
+            status['total_liquid'], ', stale: ' + ' '.join(status['stale']) if status['stale'] else ''))
+
+    def close(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+def get_fleet_status(port=FLEET_PORT, host='127.0.0.1', timeout=1):
+    """ Latest fleet status from a running aggregator """
+    with socket.create_connection((host, port), timeout) as sock:
+        data = b''
+        while not data.endswith(b'\n'):
+            chunk = sock.recv(1 << 16)
+            if not chunk:
+                break
+            data += chunk
+    return json.loads(data.decode())
+
+
+if __name__ == '__main__':
+    interval = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    filename = sys.argv[2] if len(sys.argv) > 2 else '/tmp/fleet_status.json'
+    FleetAggregator(interval, filename=filename).run()
+    sys.exit(0)
@@ -0,0 +1,133 @@
+import os, time, struct, threading
+import numpy as np
+from ClipCache import FileLock, evict
+from Registry import LazyModule
+imageio = LazyModule('imageio')
+
+
+class FrameStore:
+    """ This class handles clips decoded once into raw uint8 frames
+    frames are stored as .npy files named by the clip hash and memory mapped as (n_frames, height, width, 3)
+    arrays, so frame delivery is an index into the page cache independent of the codec.
+    """
+
+    def __init__(self, path, max_bytes=20e9):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.pinned = set()  # decoded clips in use by this process, never evicted
+        if not os.path.isdir(self.path):  # create path if necessary
+            os.makedirs(self.path)
+
+    def get(self, clip_file):
+        """ Return the memory mapped frames of a clip, decoding it if necessary """
+        clip_hash = os.path.splitext(os.path.basename(clip_file))[0]
+        filename = os.path.join(self.path, clip_hash + '.npy')
+        if not os.path.isfile(filename):
+            self.__decode(clip_file, filename)
+        os.utime(filename)  # mark as recently used
+        self.pinned.add(clip_hash)
+        return np.load(filename, mmap_mode='r')
+
+    def prepare(self, clip_files):
+        """ Decode all clips before the session starts """
+        for clip_file in clip_files:
+            self.get(clip_file)
+        with FileLock(os.path.join(self.path, 'cache.lock')):
+            evict(self.path, self.max_bytes, self.pinned)
+
+    def __decode(self, clip_file, filename):
+        print('Decoding %s' % clip_file)
+        tmp_filename = '%s.%d.%d.tmp' % (filename, os.getpid(), threading.get_ident())
+        vid = imageio.get_reader(clip_file, 'ffmpeg')
+        n_frames, shape = 0, (0, 0, 3)
+        with open(tmp_filename, 'wb') as f:  # frames are written once, the header when their count is known
+            f.write(npy_header((0,) + shape))
+            for frame in vid:
+                f.write(np.ascontiguousarray(frame, dtype=np.uint8).tobytes())
+                n_frames += 1
+                shape = frame.shape
+            f.seek(0)
+            f.write(npy_header((n_frames,) + shape))
+        vid.close()
+        os.replace(tmp_filename, filename)
+
+
+def npy_header(shape, size=128):
+    """ Header of a uint8 .npy file of a fixed size, so it can be rewritten once the shape is known """
+    header = "{'descr': '|u1', 'fortran_order': False, 'shape': %r, }" % (tuple(shape),)
+    header = header.ljust(size - 11) + '\n'
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1')
+
+
+class FrameStream:
+    """ This class handles streaming playback of a clip
+    a decoder thread runs ahead of the presentation into a preallocated ring of frame buffers,
+    so the presenter only pops a decoded frame and blits it.
+    ring: (depth, height, width, 3) uint8 array, reused between trials
+    """
+
+    def __init__(self, vid, ring):
+        self.vid = vid
+        self.ring = ring
+        self.depth = ring.shape[0]
+        self.free = threading.Semaphore(self.depth)
+        self.filled = threading.Semaphore(0)
+        self.running = threading.Event()
+        self.running.set()
+        self.decoded = 0          # frames written by the decoder
+        self.popped = 0           # frames taken by the presenter
+        self.done = False
+        self.underruns = 0
+        self.decode_times = []
+        self.queue_depths = []
+        self.thread = threading.Thread(target=self.__decode, daemon=True)
+        self.thread.start()
+
+    def pop(self):
+        """ Next decoded frame or None at the end of the clip, release() it after the blit """
+        self.queue_depths.append(self.decoded - self.popped)
+        if not self.filled.acquire(blocking=False):
+            if self.done and self.decoded == self.popped:
+                return None
+            self.underruns += 1  # decoder fell behind, wait for it
+            while not self.filled.acquire(timeout=0.1):
+                if self.done and self.decoded == self.popped:
+                    return None
+        frame = self.ring[self.popped % self.depth]
+        self.popped += 1
+        return frame
+
+    def release(self):
+        self.free.release()
+
+    def stats(self):
+        """ Queue depth, decode time (ms) & underruns of the trial """
+        return dict(frames=self.popped,
+                    underruns=self.underruns,
+                    mean_depth=np.mean(self.queue_depths) if self.queue_depths else 0,
+                    min_depth=np.min(self.queue_depths) if self.queue_depths else 0,
+                    mean_decode=1000 * np.mean(self.decode_times) if self.decode_times else 0,
+                    max_decode=1000 * np.max(self.decode_times) if self.decode_times else 0)
+
+    def close(self):
+        self.running.clear()
+        self.thread.join()
+        self.vid.close()
+
+    def __decode(self):
+        try:
+            while self.running.is_set():
+                if not self.free.acquire(timeout=0.1):
+                    continue
+                tic = time.perf_counter()
+                try:
+                    frame = self.vid.get_next_data()
+                except (IndexError, StopIteration):  # end of clip
+                    self.free.release()
+                    break
+                self.ring[self.decoded % self.depth] = frame
+                self.decode_times.append(time.perf_counter() - tic)
+                self.decoded += 1
+                self.filled.release()
+        finally:
+            self.done = True
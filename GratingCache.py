@@ -0,0 +1,99 @@
+import os, hashlib, multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+
+def make_grating(size, lamda=50, theta=0, phase=0, contrast=100, square=False, lut=False, steps=1024):
+    """ Makes an oriented grating as a (w, w) uint8 array, w = max(size) + 2 * lamda
+    lamda: wavelength (number of pixels per cycle)
+    theta: grating orientation in degrees
+    phase: phase of the grating
+    lut: uint8 values of one cycle, computed from contrast & square if not given
+
+    The profile of one cycle is computed once and looked up row by row into a preallocated buffer,
+    so no full size float temporaries are created.
+    """
+    w = int(np.max(size) + 2 * lamda)
+    freq = w / lamda  # compute frequency from wavelength
+    if lut is False:
+        lut = make_lut(contrast, square, steps)
+    steps = len(lut)
+
+    # cycles along each axis, change orientation by adding them in different proportions
+    x0 = np.linspace(0, 1, w) - 0.5
+    theta_rad = (theta / 180) * np.pi
+    xt = x0 * np.cos(theta_rad) * freq * steps
+    yt = x0 * np.sin(theta_rad) * freq * steps + phase / (2 * np.pi) * steps
+    grating = np.empty((w, w), dtype=np.uint8)
+    rows = max(1, (1 << 16) // w)  # rows per chunk, keeps temporaries small
+    for row in range(0, w, rows):
+        idx = np.add.outer(yt[row:row + rows], xt)
+        np.take(lut, np.mod(np.int64(np.floor(idx)), steps), out=grating[row:row + rows])
+    return grating
+
+
+def make_lut(contrast=100, square=False, steps=1024):
+    """ uint8 values of one grating cycle """
+    profile = (np.sin(np.arange(steps) / steps * 2 * np.pi) + 1) / 2
+    if square > 0:
+        profile = np.double(profile > 0.5)
+    return np.uint8(np.floor((profile * contrast / 100 + (100 - contrast) / 200) * 255))
+
+
+def make_phase_grating(size, lamda=50, theta=0, phase=0):
+    """ Makes a grating of the spatial phase as a size uint8 array, 256 steps per cycle
+    used as an 8-bit surface whose palette maps the phase to the luminance, so it drifts by rotating the palette
+    """
+    grating = make_grating(size, lamda, theta, phase, lut=np.arange(256, dtype=np.uint8))
+    return np.ascontiguousarray(grating[:size[0], :size[1]])
+
+
+def save_grating(filename, *args):
+    """ Make a grating and store it atomically, runs in the worker processes
+    args without contrast & square make a phase grating
+    """
+    tmp_filename = '%s.%d.tmp' % (filename, os.getpid())
+    with open(tmp_filename, 'wb') as f:
+        np.save(f, make_grating(*args) if len(args) > 4 else make_phase_grating(*args))
+    os.replace(tmp_filename, filename)
+    return filename
+
+
+class GratingCache:
+    """ This class handles a disk cache of gratings
+    gratings are stored as uint8 .npy files keyed by (size, spatial_period, direction, phase, contrast, square),
+    or by (size, spatial_period, direction, phase) for phase gratings,
+    and missing ones are generated in parallel by a process pool.
+    """
+
+    def __init__(self, path, max_workers=None):
+        self.path = path
+        self.max_workers = max_workers if max_workers else os.cpu_count()
+        if not os.path.isdir(self.path):  # create path if necessary
+            os.makedirs(self.path)
+
+    def prepare(self, gratings):
+        """ Make sure all gratings are on disk
+        gratings: list of (size, spatial_period, direction, phase, contrast, square)
+                  or (size, spatial_period, direction, phase) tuples
+        returns the list of the filenames
+        """
+        filenames = [self.filename(*grating) for grating in gratings]
+        missing = dict((filename, grating) for filename, grating in zip(filenames, gratings)
+                       if not os.path.isfile(filename))
+        if missing:
+            context = multiprocessing.get_context('spawn')  # workers only need numpy
+            with ProcessPoolExecutor(max_workers=min(self.max_workers, len(missing)), mp_context=context) as pool:
+                list(pool.map(save_grating, missing.keys(), *zip(*missing.values())))
+        return filenames
+
+    def get(self, *grating):
+        """ Load a grating, making it if necessary """
+        return np.load(self.prepare([grating])[0])
+
+    def filename(self, size, lamda, theta, phase, contrast=None, square=None):
+        key = (tuple(int(s) for s in size), int(lamda), float(theta), float(phase))
+        if contrast is not None:
+            key += (float(contrast), bool(square))
+        key = repr(key)
+        return os.path.join(self.path, hashlib.sha1(key.encode()).hexdigest() + '.npy')
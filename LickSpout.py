@@ -5,11 +5,31 @@ from Timer import *
 from concurrent.futures import ThreadPoolExecutor
 from importlib import util
 from ThreadWorker import GetHWPoller
-import serial
+from Registry import LazyModule
+from Metrics import counter
 import sys
+serial = LazyModule('serial')  # only for the serial probes
 import platform
 
 
+LICKS = dict((probe, counter('licks', probe=probe)) for probe in (1, 2))
+PULSES = dict((probe, counter('liquid_pulses', probe=probe)) for probe in (1, 2))
+
+
+def get_calibration(setup):
+    """ Fetch the most recent liquid calibration of each probe of a setup
+    returns a dictionary of probe: (pulse_dur, pulse_num, weight)
+    """
+    calibration = dict()
+    probes = (LiquidCalibration() & dict(setup=setup)).fetch('probe')
+    for probe in list(set(probes)):
+        key = dict(setup=setup, probe=probe)
+        dates = (LiquidCalibration() & key).fetch('date', order_by='date')
+        key['date'] = dates[-1]  # use the most recent calibration
+        calibration[probe] = (LiquidCalibration.PulseWeight() & key).fetch('pulse_dur', 'pulse_num', 'weight')
+    return calibration
+
+
 class Probe:
     def __init__(self, logger):
         self.logger = logger
@@ -42,15 +62,21 @@ class Probe:
             #print('Probe 2 activated')
         else:
             probe = 0
+        if probe:
+            self.logger.trace.poll(probe)
         return probe
 
     def probe1_licked(self, channel):
+        self.logger.trace.start(1)
+        LICKS[1].inc()
         self.probe1 = True
         self.timer_probe1.start()
         self.logger.log_lick(1)
         #print('Probe 1 activated')
 
     def probe2_licked(self, channel):
+        self.logger.trace.start(2)
+        LICKS[2].inc()
         self.probe2 = True
         self.timer_probe2.start()
         self.logger.log_lick(2)
@@ -67,14 +93,10 @@ class Probe:
 
     def __calc_pulse_dur(self, reward_amount):  # calculate pulse duration for the desired reward amount
         self.liquid_dur = dict()
-        probes = (LiquidCalibration() & dict(setup=self.logger.setup)).fetch('probe')
-        for probe in list(set(probes)):
-            key = dict(setup=self.logger.setup, probe=probe)
-            dates = (LiquidCalibration() & key).fetch('date', order_by='date')
-            key['date'] = dates[-1]  # use the most recent calibration
-            pulse_dur, pulse_num, weight = (LiquidCalibration.PulseWeight() & key).fetch('pulse_dur',
-                                                                                         'pulse_num',
-                                                                                         'weight')
+        calibration = self.logger.setup_conf.get('calibration')  # shared by the Supervisor
+        if not calibration:
+            calibration = get_calibration(self.logger.setup)
+        for probe, (pulse_dur, pulse_num, weight) in calibration.items():
             self.liquid_dur[probe] = numpy.interp(reward_amount,
                                                   numpy.divide(weight, pulse_num),
                                                   pulse_dur)
@@ -90,12 +112,13 @@ class RPProbe(Probe):
         self.setup = int(''.join(list(filter(str.isdigit, socket.gethostname()))))
         self.GPIO = GPIO
         self.GPIO.setmode(self.GPIO.BCM)
-        self.GPIO.setup([17, 27, 9], self.GPIO.IN)
-        self.GPIO.setup([22, 23, 24, 25], self.GPIO.OUT, initial=self.GPIO.LOW)
-        self.channels = {'air': {1: 24, 2: 25},
-                         'liquid': {1: 22, 2: 23},
-                         'lick': {1: 17, 2: 27},
-                         'start': {1: 9}}  # 2
+        self.channels = logger.setup_conf.get('channels', {'air': {1: 24, 2: 25},
+                                                           'liquid': {1: 22, 2: 23},
+                                                           'lick': {1: 17, 2: 27},
+                                                           'start': {1: 9}})  # 2
+        self.GPIO.setup(list(self.channels['lick'].values()) + list(self.channels['start'].values()), self.GPIO.IN)
+        self.GPIO.setup(list(self.channels['liquid'].values()) + list(self.channels['air'].values()),
+                        self.GPIO.OUT, initial=self.GPIO.LOW)
         self.frequency = 20
         self.GPIO.add_event_detect(self.channels['lick'][2], self.GPIO.RISING, callback=self.probe2_licked, bouncetime=200)
         self.GPIO.add_event_detect(self.channels['lick'][1], self.GPIO.RISING, callback=self.probe1_licked, bouncetime=200)
@@ -109,7 +132,9 @@ class RPProbe(Probe):
     def give_liquid(self, probe, duration=False, log=True):
         if not duration:
             duration = self.liquid_dur[probe]
-        self.thread.submit(self.__pulse_out, self.channels['liquid'][probe], duration)
+        self.logger.trace.mark('give_liquid')
+        PULSES[probe].inc()
+        self.thread.submit(self.__pulse_out, self.channels['liquid'][probe], duration, self.logger.trace.take())
         if log:
             self.logger.log_liquid(probe)
 
@@ -149,8 +174,10 @@ class RPProbe(Probe):
         sleep(duration/1000)    # to add a  delay in seconds
         pwm.stop()
 
-    def __pulse_out(self, channel, duration):
+    def __pulse_out(self, channel, duration, event=-1):
+        self.logger.trace.mark('pulse', event)
         self.GPIO.output(channel, self.GPIO.HIGH)
+        self.logger.trace.mark('valve', event)
         sleep(duration/1000)
         self.GPIO.output(channel, self.GPIO.LOW)
 
@@ -158,7 +185,7 @@ class RPProbe(Probe):
         self.GPIO.remove_event_detect(self.channels['lick'][1])
         self.GPIO.remove_event_detect(self.channels['lick'][2])
         self.GPIO.remove_event_detect(self.channels['start'][1])
-        self.GPIO.cleanup()
+        self.GPIO.cleanup([channel for port in self.channels.values() for channel in port.values()])  # only ours
 
 
 class SerialProbe(Probe):
@@ -185,7 +212,9 @@ class SerialProbe(Probe):
     def give_liquid(self, probe, duration=False, log=True):
         if not duration:
             duration = self.liquid_dur[probe]
-        self.thread.submit(self.__pulse_out, probe, duration)
+        self.logger.trace.mark('give_liquid')
+        PULSES[probe].inc()
+        self.thread.submit(self.__pulse_out, probe, duration, self.logger.trace.take())
         if log:
             self.logger.log_liquid(probe)
 
@@ -203,13 +232,15 @@ class SerialProbe(Probe):
             if self.timer_probe2.elapsed_time() > 200:
                 self.probe2_licked(2)
 
-    def __pulse_out(self, probe, duration):
+    def __pulse_out(self, probe, duration, event=-1):
+        self.logger.trace.mark('pulse', event)
         while self.interlock:  # busy, wait for free, should timeout here
             print("waiting for interlock")
             sys.stdout.flush()
         print('reward!')
         self.interlock = True
         setattr(self.serial, self.channels['out'][probe], True)
+        self.logger.trace.mark('valve', event)
         sleep(duration/1000)
         setattr(self.serial, self.channels['out'][probe], False)
         self.interlock = False
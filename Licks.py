@@ -0,0 +1,72 @@
+import os, multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from Database import *
+
+
+def pack_licks(licks, start_time):
+    """ Packs the licks of a trial into the TrialLicks fields
+    licks: list of (time, probe) from session start (ms)
+    start_time: trial start from session start (ms)
+    """
+    licks = np.array(licks, dtype=np.int64).reshape(-1, 2)
+    probes, counts = np.unique(licks[:, 1], return_counts=True)
+    times = []
+    for probe in probes:
+        probe_times = np.sort(licks[licks[:, 1] == probe, 0])
+        times.append(np.diff(probe_times, prepend=start_time))
+    return dict(lick_count=len(licks),
+                probes=np.int32(probes),
+                probe_licks=np.int32(counts),
+                lick_times=np.int32(np.concatenate(times)) if times else np.zeros(0, dtype=np.int32))
+
+
+def unpack_licks(start_time, probes, probe_licks, lick_times):
+    """ Times (ms from session start) & probes of the licks of a TrialLicks row, sorted by time """
+    counts = np.int64(np.ravel(probe_licks))
+    probes = np.repeat(np.ravel(probes), counts)
+    times = np.cumsum(np.int64(np.ravel(lick_times)))
+    starts = np.cumsum(counts) - counts
+    offsets = np.where(starts > 0, times[np.maximum(starts - 1, 0)] if len(times) else 0, 0)
+    times = times - np.repeat(offsets, counts) + start_time  # restart the cumulative sum at each probe
+    order = np.argsort(times, kind='stable')
+    return times[order], probes[order]
+
+
+def fetch_licks(restriction):
+    """ Lick times & probes of the trials in restriction, one row per trial instead of one per lick
+    returns dict of trial_idx: (times, probes)
+    """
+    rows = (Trial() * TrialLicks() & restriction).fetch('trial_idx', 'start_time', 'probes', 'probe_licks',
+                                                         'lick_times', as_dict=True)
+    return {row['trial_idx']: unpack_licks(row['start_time'], row['probes'], row['probe_licks'], row['lick_times'])
+            for row in rows}
+
+
+def migrate_session(key):
+    """ Packs the Lick rows of a session into TrialLicks, a lick belongs to the first trial ending after it
+    licks after the end of the last trial are only kept in Lick
+    """
+    trials = (Trial() & key).fetch(order_by='end_time', as_dict=True)
+    if not trials:
+        return 0
+    times, probes = (Lick() & key).fetch('time', 'probe')
+    end_times = np.array([trial['end_time'] for trial in trials])
+    trial_of_lick = np.searchsorted(end_times, times, side='left')
+    rows = []
+    for idx, trial in enumerate(trials):
+        in_trial = trial_of_lick == idx
+        rows.append(dict(dict((k, trial[k]) for k in Trial().primary_key),
+                         **pack_licks(np.stack((times[in_trial], probes[in_trial]), 1), trial['start_time'])))
+    TrialLicks().insert(rows, skip_duplicates=True)
+    return len(rows)
+
+
+def migrate(restriction=dict(), max_workers=None):
+    """ Migrates all sessions with trials but no TrialLicks in parallel, one session per worker task """
+    keys = ((Session() & Trial() & restriction) - TrialLicks()).fetch('KEY')
+    print('Migrating %d sessions' % len(keys))
+    context = multiprocessing.get_context('spawn')  # workers open their own db connection
+    with ProcessPoolExecutor(max_workers=max_workers if max_workers else os.cpu_count(), mp_context=context) as pool:
+        for key, trials in zip(keys, pool.map(migrate_session, keys)):
+            print('%d trials of animal %d session %d' % (trials, key['animal_id'], key['session_id']))
@@ -1,24 +1,35 @@
 import numpy, socket
 from Timer import *
 from Database import *
+from Notifications import NotificationListener, NOTIFY_PORT
+from Licks import pack_licks
+from Trace import LatencyTrace
+from Metrics import counter, gauge, start_exporter
 from itertools import product
 from queue import Queue
+from collections import deque
 import time as systime
 import datetime
 #from threading import Thread
+QUEUE_DEPTH = gauge('logger_queue_depth')
+DB_INSERTS = counter('db_inserts')
+DB_QUERIES = counter('db_queries')  # state polling & updates of the trial loop
 
 
 class Logger:
     """ This class handles the database logging"""
 
-    def __init__(self):
+    def __init__(self, setup_conf=None):
         self.session_key = dict()
-        self.setup = socket.gethostname()
+        self.setup_conf = setup_conf if setup_conf else dict()  # per setup settings, see Supervisor.load_setup_conf
+        self.setup = self.setup_conf.get('setup', socket.gethostname())
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         s.connect(("8.8.8.8", 80))
         self.ip = s.getsockname()[0]
         print(self.ip)
         self.init_params()
+        start_exporter(self.setup_conf.get('metrics_file', '/tmp/metrics_%s.prom' % self.setup),
+                       self.setup_conf.get('metrics_interval', 10), setup=self.setup)  # rig load snapshots
         #self.thread = Thread(target=self.inserter)
         #self.thread.daemon = True
         #self.thread.start()
@@ -31,11 +42,32 @@ class Logger:
         self.curr_cond = []
         self.task_idx = []
         self.reward_amount = []
+        self.trace = LatencyTrace(self.setup_conf.get('trace_events', 20000))  # lick to valve latency
 
     def log_session(self):
         """Logs session"""
         pass
 
+    def resume_session(self, state):
+        """Continues the session of a checkpoint, returns False if the setup has moved on to another session"""
+        return False
+
+    def get_state(self):
+        """Session state stored in checkpoints"""
+        return dict(session_key=self.session_key,
+                    task_idx=self.task_idx,
+                    reward_amount=self.reward_amount,
+                    last_trial=self.last_trial,
+                    start_time=self.timer.start_time)
+
+    def _resume_state(self, state):
+        self.session_key.update(state['session_key'])
+        self.task_idx = state['task_idx']
+        self.reward_amount = state['reward_amount']
+        trials = (Trial() & self.session_key).fetch('trial_idx')  # trials logged after the last checkpoint
+        self.last_trial = max([state['last_trial']] + list(trials))
+        self.timer.start_time = state['start_time']  # trial times stay relative to the session start
+
     def log_conditions(self, condition_table):
         """Logs conditions"""
         pass
@@ -43,10 +75,22 @@ class Logger:
     def start_trial(self, cond_idx):
         self.trial_start = self.timer.elapsed_time()
 
-    def log_trial(self, last_flip_count=0):
+    def get_condition(self, condition_table, cond_idx, *attrs):
+        """Get the parameters of a condition of the session"""
+        return (condition_table() & dict(cond_idx=cond_idx) & self.session_key).fetch1(*attrs)
+
+    def log_trial(self, last_flip_count=0, flip_stats=False):
         """Log experiment trial"""
         pass
 
+    def log_trial_info(self, table, info):
+        """Log additional information of the last trial"""
+        pass
+
+    def log_latency(self):
+        """Log the latency of the reward path of the session"""
+        pass
+
     def log_setup(self):
         """Log setup information"""
         pass
@@ -68,9 +112,12 @@ class Logger:
         pass
 
     def inserter(self):  # insert worker, in case we need threading
+        QUEUE_DEPTH.set(self.queue.qsize())
         while not self.queue.empty():
             item = self.queue.get()
             item['table'].insert1(item['tuple'], ignore_extra_fields=True)
+            DB_INSERTS.inc()
+            QUEUE_DEPTH.set(self.queue.qsize())  # the exporter may sample while draining
 
 
 class RPLogger(Logger):
@@ -84,6 +131,9 @@ class RPLogger(Logger):
         self.curr_cond = []
         self.task_idx = []
         self.reward_amount = []
+        self.trace = LatencyTrace(self.setup_conf.get('trace_events', 20000))  # lick to valve latency
+        self.licks = deque()      # (time, probe) of the licks since the last trial, appended by the lick callbacks
+        self.total_liquid = 0
 
     def log_session(self):
 
@@ -115,6 +165,22 @@ class RPLogger(Logger):
         (SetupInfo() & dict(setup=self.setup))._update('last_trial', 0)
         (SetupInfo() & dict(setup=self.setup))._update('total_liquid', 0)
 
+    def resume_session(self, state):
+        key = state['session_key']
+        animal_id, task_idx, session_id = (SetupInfo() & dict(setup=self.setup)).fetch1(
+            'animal_id', 'task_idx', 'current_session')
+        if (animal_id, task_idx, session_id) != (key['animal_id'], state['task_idx'], key['session_id']) \
+                or not Session() & key:
+            return False
+        self._resume_state(state)
+        self.total_liquid = state['total_liquid']
+        (SetupInfo() & dict(setup=self.setup))._update('last_trial', self.last_trial)
+        (SetupInfo() & dict(setup=self.setup))._update('total_liquid', self.total_liquid)
+        return True
+
+    def get_state(self):
+        return dict(super(RPLogger, self).get_state(), total_liquid=self.total_liquid)
+
     def log_conditions(self, condition_table):
 
         # generate factorial conditions
@@ -153,7 +219,7 @@ class RPLogger(Logger):
         # return condition key
         return dict(self.session_key, cond_idx=cond_idx)
 
-    def log_trial(self, last_flip_count=0):
+    def log_trial(self, last_flip_count=0, flip_stats=False):
         timestamp = self.timer.elapsed_time()
         trial_key = dict(self.session_key,
                          trial_idx=self.last_trial+1,
@@ -162,20 +228,36 @@ class RPLogger(Logger):
                          end_time=timestamp,
                          last_flip_count=last_flip_count)
         self.queue.put(dict(table=Trial(), tuple=trial_key))
+        if flip_stats:
+            self.queue.put(dict(table=FlipStats(), tuple=dict(trial_key, **flip_stats)))
+        licks = [self.licks.popleft() for _ in range(len(self.licks))]  # later licks stay for the next trial
+        self.queue.put(dict(table=TrialLicks(), tuple=dict(trial_key, **pack_licks(licks, self.trial_start))))
         self.last_trial += 1
         self.inserter()
 
         # insert ping
+        DB_QUERIES.inc()
         (SetupInfo() & dict(setup=self.setup))._update('last_trial', self.last_trial)
         self.ping()
 
+    def log_trial_info(self, table, info):
+        self.queue.put(dict(table=table(), tuple=dict(self.session_key, trial_idx=self.last_trial, **info)))
+        self.inserter()
+
     def log_liquid(self, probe):
         timestamp = self.timer.elapsed_time()
         self.queue.put(dict(table=LiquidDelivery(), tuple=dict(self.session_key, time=timestamp, probe=probe)))
         self.inserter()
         rew = (LiquidDelivery & self.session_key).__len__()*(Session() & self.session_key).fetch1('reward_amount')/1000
+        self.total_liquid = rew
+        DB_QUERIES.inc(3)
         (SetupInfo() & dict(setup=self.setup))._update('total_liquid', rew)
 
+    def log_latency(self):
+        for row in self.trace.summary():
+            self.queue.put(dict(table=RewardLatency(), tuple=dict(self.session_key, **row)))
+        self.inserter()
+
     def log_odor(self, odor_idx):
         timestamp = self.timer.elapsed_time()
         self.queue.put(dict(table=OdorDelivery(), tuple=dict(self.session_key, time=timestamp, odor_idx=odor_idx)))
@@ -186,6 +268,7 @@ class RPLogger(Logger):
         self.queue.put(dict(table=Lick(), tuple=dict(self.session_key,
                                                      time=timestamp,
                                                      probe=probe)))
+        self.licks.append((timestamp, probe))
         #self.inserter()
 
     def log_air(self, probe):
@@ -226,6 +309,7 @@ class RPLogger(Logger):
         (SetupInfo() & dict(setup=self.setup))._update('notes', note)
 
     def get_setup_state(self):
+        DB_QUERIES.inc()
         state = (SetupInfo() & dict(setup=self.setup)).fetch1('state')
         return state
 
@@ -237,6 +321,7 @@ class RPLogger(Logger):
         return self.session_key
 
     def ping(self):
+        DB_QUERIES.inc(2)
         if numpy.size((SetupInfo() & dict(setup=self.setup)).fetch()):
             lp = str(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
             (SetupInfo() & dict(setup=self.setup))._update('last_ping', lp)
@@ -245,15 +330,32 @@ class RPLogger(Logger):
 class PCLogger(Logger):
     """ This class handles the database logging for 2P systems"""
 
-    def __init__(self):
+    def __init__(self, setup_conf=None):
         from DatabaseForControl import SetupControl
         self.SetupControl = SetupControl
-        super(PCLogger, self).__init__()     
+        super(PCLogger, self).__init__(setup_conf)
+        self.notify_timeout = self.setup_conf.get('notify_timeout', 0.05)  # wait for the trial end notification (s)
+        self.poll_interval = self.setup_conf.get('poll_interval', 1)       # database fallback polling interval (s)
+        # trial_done & exp_done polling interval without notifications (s)
+        self.notify_poll_interval = self.setup_conf.get('notify_poll_interval', 0.05)
+        self.last_poll = dict()
+        self.done = dict()        # last trial_done & exp_done values
+        self.setup_state = None
+        self.notifications = None
+        notify_port = self.setup_conf.get('notify_port')  # off until the stimulus sends notifications
+        if notify_port:
+            try:
+                self.notifications = NotificationListener(NOTIFY_PORT if notify_port is True else notify_port)
+            except OSError:
+                print('Notification port is in use, polling the database instead')
 
     def init_params(self):
+        self.last_trial = 0
         self.queue = Queue()
         self.timer = Timer()
         self.task_idx = []
+        self.reward_amount = []
+        self.trace = LatencyTrace(self.setup_conf.get('trace_events', 20000))  # lick to valve latency
         self.last_time = systime.time()
         self.trial_idx = []
 
@@ -287,6 +389,15 @@ class PCLogger(Logger):
         self.timer.start()
         self.inserter()
 
+    def resume_session(self, state):
+        key = state['session_key']
+        animal_id, task_idx = (self.SetupControl() & dict(setup=self.setup)).fetch1('animal_id', 'task_idx')
+        later = Session() & dict(animal_id=animal_id) & 'session_id > %d' % key['session_id']
+        if (animal_id, task_idx) != (key['animal_id'], state['task_idx']) or not Session() & key or later:
+            return False
+        self._resume_state(state)
+        return True
+
     def log_liquid(self, probe):
         timestamp = self.timer.elapsed_time()
         self.queue.put(dict(table=LiquidDelivery(), tuple=dict(self.session_key, time=timestamp, probe=probe)))
@@ -303,15 +414,33 @@ class PCLogger(Logger):
         in_state = key['state'] == state
         if not in_state:
             (self.SetupControl() & dict(setup=self.setup))._update('state', state)
+        self.setup_state = state
+        self.last_poll['state'] = systime.time()
+        if state == 'stimRunning':  # protocol is prepared, forget the previous run
+            if self.notifications:
+                self.notifications.clear()
+            self.done = dict()
+            self.last_poll.pop('trial_done', None)
+            self.last_poll.pop('exp_done', None)
 
     def get_setup_state(self):
-        state = (self.SetupControl() & dict(setup=self.setup)).fetch1('state')
-        return state
+        """state is cached and refreshed from the database every poll_interval
+        assumes this process is the only writer of state during a run: ExpControl sets all the states it checks.
+        A state written by another client, e.g. a reset from 2pMaster, is only seen at the next refresh.
+        """
+        if self.setup_state is None or self.__poll_due('state'):
+            self.setup_state = (self.SetupControl() & dict(setup=self.setup)).fetch1('state')
+            self.last_poll['state'] = systime.time()
+            DB_QUERIES.inc()
+        return self.setup_state
 
     def get_setup_state_control(self):
         state = (self.SetupControl() & dict(setup=self.setup)).fetch1('state_control')
         return state
 
+    def update_setup_state_control(self, state_control):
+        (self.SetupControl() & dict(setup=self.setup))._update('state_control', state_control)
+
     def get_setup_task(self):
         task = (self.SetupControl() & dict(setup=self.setup)).fetch1('task')
         return task
@@ -333,6 +462,7 @@ class PCLogger(Logger):
             lp = format(datetime.datetime.now(),"%Y-%m-%d %H:%M:%S")
             (self.SetupControl() & dict(setup=self.setup))._update('last_ping', lp)
             self.last_time = nw
+            DB_QUERIES.inc()
 
     def get_scan_key(self):
         animal_id = (self.SetupControl() & dict(setup=self.setup)).fetch1('animal_id')
@@ -356,12 +486,15 @@ class PCLogger(Logger):
         self.trial_idx = next_trial
 
     def get_trial_done(self):
-        trial_done = (self.SetupControl() & dict(setup=self.setup)).fetch1('trial_done')
-        return trial_done
+        """blocks up to notify_timeout for the trial end notification, polls the database at a low rate"""
+        if self.notifications and self.notifications.wait('trial_done', 1, self.notify_timeout):
+            return 1
+        return self.__poll_done('trial_done')
 
     def get_exp_done(self):
-        exp_done = (self.SetupControl() & dict(setup=self.setup)).fetch1('exp_done')
-        return exp_done
+        if self.notifications and self.notifications.wait('exp_done', 1, 0):
+            return 1
+        return self.__poll_done('exp_done')
 
     def get_sync_levels(self):
         sync_levels = (self.SetupControl() & dict(setup=self.setup)).fetch1('level1','level2','level3')
@@ -369,4 +502,21 @@ class PCLogger(Logger):
 
     def update_trial_done(self, state):
         (self.SetupControl() & dict(setup=self.setup))._update('trial_done', state)
+        if self.notifications:
+            self.notifications.set('trial_done', state)
+        self.done['trial_done'] = state
+        self.last_poll['trial_done'] = systime.time()
+
+    def __poll_done(self, field):
+        """database value, read every notify_poll_interval, or every poll_interval as a fallback to notifications"""
+        if self.__poll_due(field, self.poll_interval if self.notifications else self.notify_poll_interval):
+            self.done[field] = (self.SetupControl() & dict(setup=self.setup)).fetch1(field)
+            self.last_poll[field] = systime.time()
+            DB_QUERIES.inc()
+            if self.notifications:
+                self.notifications.set(field, self.done[field])
+        return self.done.get(field, 0)
+
+    def __poll_due(self, field, interval=None):
+        return systime.time() - self.last_poll.get(field, 0) > (self.poll_interval if interval is None else interval)
 
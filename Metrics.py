@@ -0,0 +1,171 @@
+import os, json, time, bisect, threading
+import numpy as np
+
+# # # # Hot path metrics # # # # #
+# counters, gauges & fixed bucket histograms whose values live in preallocated arrays, created once at import:
+#   FLIPS = counter('flips')                 FLIPS.inc()
+#   DEPTH = gauge('logger_queue_depth')      DEPTH.set(queue.qsize())
+#   IFI = histogram('flip_interval_ms', (10, 20, 50))   IFI.observe(16.7)
+# an exporter thread writes snapshots to a local file, in the prometheus text format or json (.json files).
+# Updates from different threads are not locked, a rare lost increment is accepted for metrics.
+MAX_METRICS = 256
+MAX_BUCKETS = 16
+
+
+class Metric:
+    def __init__(self, registry, kind, idx):
+        self.registry = registry
+        self.kind = kind
+        self.idx = idx
+
+
+class Counter(Metric):
+    def inc(self, value=1):
+        self.registry.values[self.idx] += value
+
+
+class Gauge(Metric):
+    def set(self, value):
+        self.registry.values[self.idx] = value
+
+
+class Histogram(Metric):
+    def __init__(self, registry, kind, idx, bounds):
+        super(Histogram, self).__init__(registry, kind, idx)
+        self.bounds = bounds
+        self.buckets = registry.buckets[idx]
+
+    def observe(self, value):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.registry.values[self.idx] += value  # sum of the observations
+
+
+class MetricsRegistry:
+    """ Preallocated values of all the metrics of a process """
+
+    def __init__(self, max_metrics=MAX_METRICS, max_buckets=MAX_BUCKETS):
+        self.values = np.zeros(max_metrics)
+        self.buckets = np.zeros((max_metrics, max_buckets + 1))  # last bucket is +Inf
+        self.metrics = dict()  # name: Metric
+        self.names = []
+        self.lock = threading.Lock()
+
+    def get(self, name, kind, bounds=(), **labels):
+        """ Metric of a name & labels, created on first use """
+        if labels:
+            name = '%s{%s}' % (name, ','.join('%s="%s"' % item for item in sorted(labels.items())))
+        with self.lock:
+            if name not in self.metrics:
+                if len(self.names) >= len(self.values) or len(bounds) > self.buckets.shape[1] - 1:
+                    raise ValueError('No room for metric %s' % name)
+                idx = len(self.names)
+                if kind == 'histogram':
+                    self.metrics[name] = Histogram(self, kind, idx, tuple(sorted(bounds)))
+                else:
+                    self.metrics[name] = (Counter if kind == 'counter' else Gauge)(self, kind, idx)
+                self.names.append(name)
+            return self.metrics[name]
+
+    def snapshot(self):
+        """ Copy of the current values, dict of name: (kind, value, bounds, bucket counts) """
+        with self.lock:
+            metrics = list(self.metrics.items())
+        values, buckets = self.values.copy(), self.buckets.copy()
+        return dict((name, (metric.kind, values[metric.idx], getattr(metric, 'bounds', ()),
+                            buckets[metric.idx][:len(getattr(metric, 'bounds', ())) + 1]))
+                    for name, metric in metrics)
+
+
+REGISTRY = MetricsRegistry()
+
+
+def counter(name, **labels):
+    return REGISTRY.get(name, 'counter', **labels)
+
+
+def gauge(name, **labels):
+    return REGISTRY.get(name, 'gauge', **labels)
+
+
+def histogram(name, bounds, **labels):
+    return REGISTRY.get(name, 'histogram', bounds, **labels)
+
+
+def to_text(snapshot, prefix='pyexp_', labels=''):
+    """ Prometheus text exposition of a snapshot """
+    lines, typed = [], set()
+    for name, (kind, value, bounds, counts) in sorted(snapshot.items()):
+        base, _, name_labels = name.partition('{')
+        if kind == 'counter' and not base.endswith('_total'):  # naming convention of counters
+            base += '_total'
+        name_labels = ','.join(filter(None, [labels, name_labels.rstrip('}')]))
+        if base not in typed:
+            lines.append('# TYPE %s%s %s' % (prefix, base, kind))
+            typed.add(base)
+        if kind == 'histogram':
+            for bound, count in zip(list(bounds) + ['+Inf'], np.cumsum(counts)):
+                lines.append('%s%s_bucket{%s} %d' % (prefix, base, ','.join(
+                    filter(None, [name_labels, 'le="%s"' % bound])), count))
+            lines.append('%s%s_sum%s %r' % (prefix, base, '{%s}' % name_labels if name_labels else '', float(value)))
+            lines.append('%s%s_count%s %d' % (prefix, base, '{%s}' % name_labels if name_labels else '',
+                                             np.sum(counts)))
+        else:
+            lines.append('%s%s%s %r' % (prefix, base, '{%s}' % name_labels if name_labels else '', float(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def to_json(snapshot, previous=None, interval=0):
+    """ Json of a snapshot, with the rate of the counters since the previous snapshot (1/s) """
+    metrics = dict()
+    for name, (kind, value, bounds, counts) in snapshot.items():
+        metric = dict(kind=kind, value=float(value))
+        if kind == 'counter' and previous and name in previous and interval > 0:
+            metric['rate'] = (value - previous[name][1]) / interval
+        if kind == 'histogram':
+            metric.update(bounds=list(bounds), counts=counts.tolist(), count=float(np.sum(counts)))
+        metrics[name] = metric
+    return json.dumps(dict(time=time.time(), metrics=metrics), indent=1, sort_keys=True)
+
+
+class MetricsExporter(threading.Thread):
+    """ Writes a snapshot of the registry to a file every interval seconds, replacing it atomically """
+
+    def __init__(self, filename, interval=10, labels=None, registry=REGISTRY):
+        threading.Thread.__init__(self, daemon=True)
+        self.filename = os.path.expanduser(filename)
+        self.interval = interval
+        self.labels = ','.join('%s="%s"' % item for item in sorted((labels or dict()).items()))
+        self.registry = registry
+        self.stopped = threading.Event()
+        self.previous = None
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def write(self):
+        snapshot = self.registry.snapshot()
+        if self.filename.endswith('.json'):
+            text = to_json(snapshot, self.previous, self.interval)
+        else:
+            text = to_text(snapshot, labels=self.labels)
+        self.previous = snapshot
+        tmp_filename = '%s.%d.tmp' % (self.filename, os.getpid())
+        with open(tmp_filename, 'w') as f:
+            f.write(text)
+        os.replace(tmp_filename, self.filename)
+
+    def stop(self):
+        self.stopped.set()
+
+
+EXPORTER = None
+
+
+def start_exporter(filename, interval=10, **labels):
+    """ Start the exporter of the process once, false filename disables it """
+    global EXPORTER
+    if filename and EXPORTER is None:
+        EXPORTER = MetricsExporter(filename, interval, labels)
+        EXPORTER.start()
+    return EXPORTER
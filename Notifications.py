@@ -0,0 +1,64 @@
+import socket, time
+
+# Notifications from the stimulus to the experiment control on the same host
+# one ascii UDP datagram per event sent to 127.0.0.1:NOTIFY_PORT: '<event> <value>'
+# events:
+#   trial_done 0/1    trial started/finished
+#   exp_done 0/1      protocol started/all trials done
+# e.g. from matlab: u = udpport; write(u, 'trial_done 1', 'string', '127.0.0.1', 5556)
+# PCLogger only listens when the 'notify_port' setup option is set (true for NOTIFY_PORT), for stimuli that send them
+# otherwise it reads trial_done & exp_done from the database every 'notify_poll_interval' (50 ms)
+NOTIFY_PORT = 5556
+
+
+def notify(event, value=1, port=NOTIFY_PORT, host='127.0.0.1'):
+    """ Send a notification """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.sendto(('%s %d' % (event, value)).encode(), (host, port))
+    sock.close()
+
+
+class NotificationListener:
+    """ This class receives the notifications of the stimulus and keeps the last value of each event """
+
+    def __init__(self, port=NOTIFY_PORT, host='127.0.0.1'):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.state = dict()
+
+    def wait(self, event, value, timeout):
+        """ Wait up to timeout (s) for an event to take a value, returns whether it has """
+        deadline = time.time() + timeout
+        self.__receive(0)
+        while self.state.get(event) != value and time.time() < deadline:
+            self.__receive(deadline - time.time())
+        return self.state.get(event) == value
+
+    def set(self, event, value):
+        """ Update the value of an event locally, e.g. when resetting it """
+        self.state[event] = value
+
+    def clear(self):
+        """ Drop pending notifications & values, e.g. left over from the previous run """
+        self.__receive(0)
+        self.state = dict()
+
+    def close(self):
+        self.sock.close()
+
+    def __receive(self, timeout):
+        """ Read all pending notifications, blocking up to timeout for the first one """
+        if timeout > 0:
+            self.sock.settimeout(timeout)
+        else:
+            self.sock.setblocking(False)
+        while True:
+            try:
+                message = self.sock.recv(256).decode().split()
+            except (BlockingIOError, socket.timeout):
+                return
+            self.sock.setblocking(False)
+            if len(message) == 2 and message[1].lstrip('-').isdigit():
+                self.state[message[0]] = int(message[1])
+            else:
+                print('Ignoring notification %s' % ' '.join(message))
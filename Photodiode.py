@@ -0,0 +1,97 @@
+""" Photodiode flip number code
+Every 32 sequential flips encode 32 21-bit flip numbers.
+Thus each n is a 21-bit flip number:
+FFFFFFFFFFFFFFFFCCCCP
+P = parity, only P=1 encode bits
+C = the position within F
+F = the current block of 32 flips
+Even flips are black, odd flips are 254 for a 0 bit and 127 for a 1 bit of F at position C.
+"""
+import numpy as np
+
+CODE_BITS = 21
+CODE_MASK = (1 << CODE_BITS) - 1
+
+
+def amplitude_table():
+    """ Photodiode amplitude of every flip number modulo 2^21, the code of the former per flip expression
+    127 * (n & 1) * (2 - ((n & mask) != 0)) computed once
+    """
+    n = np.arange(1 << CODE_BITS, dtype=np.int64)
+    bit = (n & (1 << (((n >> 1) & 15) + 5))) != 0
+    return np.uint8(127 * (n & 1) * (2 - bit))
+
+
+def decode(trace, fs, min_dwell=0.002, max_dwell=0.1):
+    """ Recovers the flip numbers and their times from a photodiode trace
+    trace: photodiode samples
+    fs: sampling rate (Hz)
+    min_dwell: levels shorter than this are transitions (s)
+    max_dwell: levels longer than this break the code, e.g. in between trials (s)
+    returns flip numbers & flip times (s from the first sample)
+    """
+    trace = np.asarray(trace, dtype=np.float32)
+    lo, hi = np.percentile(trace[::max(1, len(trace) // 100000)], [1, 99])
+    levels = np.digitize(trace, [lo + (hi - lo) / 4, lo + 3 * (hi - lo) / 4]).astype(np.int8)  # 0, 127 & 254
+
+    # one run of samples per flip, without the short transition runs
+    starts = np.concatenate(([0], np.flatnonzero(levels[1:] != levels[:-1]) + 1))
+    lengths = np.diff(np.concatenate((starts, [len(levels)])))
+    keep = lengths >= min_dwell * fs
+    starts, levels = starts[keep], levels[starts[keep]]
+    merge = np.concatenate(([True], levels[1:] != levels[:-1]))
+    starts, levels = starts[merge], levels[merge]
+
+    # decode each stretch of uninterrupted flips separately, long levels are not flips
+    lengths = np.diff(np.concatenate((starts, [len(trace)])))
+    flip = lengths <= max_dwell * fs
+    stretch = np.cumsum(~flip)[flip]
+    starts, levels = starts[flip], levels[flip]
+    breaks = np.flatnonzero(np.diff(stretch)) + 1
+    flips, times = [], []
+    for segment in np.split(np.arange(len(starts)), breaks):
+        numbers = _decode_segment(levels[segment])
+        if numbers is not None:
+            flips.append(numbers)
+            times.append(starts[segment] / fs)
+    if not flips:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    return np.concatenate(flips), np.concatenate(times)
+
+
+def _decode_segment(levels):
+    """ Flip numbers of a sequence of flip levels, None if it holds no complete block """
+    odd = np.flatnonzero(levels > 0)
+    if len(odd) < 32:
+        return None
+    bits = np.int64(levels[odd] == 1)
+
+    # find the position of the first odd flip within its block, consecutive blocks should increase by one
+    weights = 1 << np.arange(16, dtype=np.int64)
+    best_score, best = -1, None
+    for first in range(16):
+        start = (16 - first) % 16
+        nblocks = (len(bits) - start) // 16
+        if nblocks < 1:
+            continue
+        blocks = bits[start:start + 16 * nblocks].reshape(nblocks, 16) @ weights
+        score = np.sum(np.diff(blocks) == 1) if nblocks > 1 else 0
+        if score > best_score:
+            best_score, best = score, (first, start, blocks)
+    first, start, blocks = best
+
+    # flip numbers of the odd flips, partial blocks at the ends are extrapolated from their neighbors
+    j = np.arange(len(bits))
+    block_idx = (j - start) // 16
+    clipped = np.clip(block_idx, 0, len(blocks) - 1)
+    numbers_odd = 32 * (blocks[clipped] + block_idx - clipped) + 2 * ((j + first) % 16) + 1
+
+    # even flips follow the previous odd flip
+    runs = np.arange(len(levels))
+    previous = np.maximum.accumulate(np.where(levels > 0, runs, -1))
+    numbers = np.empty(len(levels), dtype=np.int64)
+    has_previous = previous >= 0
+    numbers[has_previous] = numbers_odd[np.searchsorted(odd, previous[has_previous])] + \
+        runs[has_previous] - previous[has_previous]
+    numbers[~has_previous] = numbers_odd[0] - (odd[0] - runs[~has_previous])
+    return numbers
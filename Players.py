@@ -0,0 +1,91 @@
+import time
+
+
+class PlayerPool:
+    """ This class keeps the player of the next clip loaded & paused at frame 0
+    so that a trial starts with a single play command instead of a process spawn & DBus handshake.
+    player: OMXPlayer compatible class
+    args: player arguments
+    """
+
+    def __init__(self, player, args):
+        self.player = player
+        self.args = args
+        self.next = None        # (filename, player, spawn time) of the loaded clip
+        self.players = 0
+
+    def load(self, filename):
+        """ Spawn a hidden paused player for the next clip """
+        if self.next is not None:
+            if self.next[0] == filename:
+                return
+            self.__quit(self.next[1])
+        tic = time.perf_counter()
+        vid = self.player(filename, args=self.args + ['--alpha', '0'], pause=True,
+                          dbus_name='org.mpris.MediaPlayer2.omxplayer%d' % (self.players % 2))
+        self.players += 1
+        self.next = (filename, vid, time.perf_counter() - tic)
+
+    def play(self, filename, timeout=1):
+        """ Start a clip, loading it first if it is not the loaded one
+        returns the player & its onset: spawn time, play command to first frame latency (ms) & preloaded flag
+        """
+        preloaded = self.next is not None and self.next[0] == filename
+        self.load(filename)
+        filename, vid, spawn_time = self.next
+        self.next = None
+        tic = time.perf_counter()
+        vid.set_alpha(255)
+        vid.play()
+        while vid.position() <= 0 and time.perf_counter() - tic < timeout:  # wait for the first frame
+            time.sleep(0.001)
+        return vid, dict(spawn_time=spawn_time * 1000,
+                         onset_latency=(time.perf_counter() - tic) * 1000,
+                         preloaded=preloaded)
+
+    def close(self):
+        if self.next is not None:
+            self.__quit(self.next[1])
+            self.next = None
+
+    def __quit(self, vid):
+        try:
+            vid.quit()
+        except:
+            pass
+
+
+class DummyPlayer:
+    """ Local stand-in of OMXPlayer for testing without a Raspberry pi, plays nothing in real time """
+
+    def __init__(self, source, args=None, dbus_name=None, pause=False, duration=5):
+        self.source = source
+        self.duration = duration
+        self.alpha = 255
+        self.start_time = None
+        self.paused_at = 0
+        if not pause:
+            self.play()
+
+    def play(self):
+        if self.start_time is None:
+            self.start_time = time.perf_counter() - self.paused_at
+
+    def pause(self):
+        if self.start_time is not None:
+            self.paused_at = self.position()
+            self.start_time = None
+
+    def position(self):
+        if self.start_time is None:
+            return self.paused_at
+        return min(time.perf_counter() - self.start_time, self.duration)
+
+    def is_playing(self):
+        return self.start_time is not None and self.position() < self.duration
+
+    def set_alpha(self, alpha):
+        self.alpha = alpha
+
+    def quit(self):
+        self.start_time = None
@@ -0,0 +1,51 @@
+import importlib
+
+# modules of the experiment, behavior & stimulus types, they are only imported when a task selects one of them
+EXPERIMENTS = dict.fromkeys(['Experiment', 'MultiProbe', 'FreeWater', 'PassiveMatlab', 'PassiveMatlabReward',
+                             'ActiveMatlab', 'CenterPort', 'DummyCenterPort', 'CenterPortTrain'], 'Experiment')
+BEHAVIORS = dict(dict.fromkeys(['Behavior', 'RPBehavior', 'TPBehavior', 'DummyProbe'], 'Behavior'),
+                 **dict.fromkeys(['Probe', 'RPProbe', 'SerialProbe', 'SerialProbeOdor'], 'LickSpout'))
+STIMULI = dict.fromkeys(['Stimulus', 'Movies', 'RPMovies', 'Gratings', 'NoStimulus', 'Psychtoolbox', 'Odors',
+                         'VisOlf', 'PTOlf'], 'Stimulus')
+REGISTRY = dict(experiment=EXPERIMENTS, behavior=BEHAVIORS, stimulus=STIMULI)
+
+
+def register(kind, name, module):
+    """ Add a type defined outside of the default modules, module is its module name or the class itself """
+    REGISTRY[kind][name] = module
+
+
+def get(kind, name):
+    """ Class of a registered type, importing its module on first use """
+    if name not in REGISTRY[kind]:
+        raise KeyError('Unknown %s type %s' % (kind, name))
+    if isinstance(REGISTRY[kind][name], type):
+        return REGISTRY[kind][name]
+    return getattr(importlib.import_module(REGISTRY[kind][name]), name)
+
+
+def get_experiment(name):
+    return get('experiment', name)
+
+
+def get_behavior(name):
+    return get('behavior', name)
+
+
+def get_stimulus(name):
+    return get('stimulus', name)
+
+
+class LazyModule:
+    """ Module that is imported on first attribute access, for heavy or hardware specific libraries
+    e.g. pygame = LazyModule('pygame') at the top of a module
+    """
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self.__dict__['_module'] = importlib.import_module(self._name)
+        return getattr(self._module, attr)
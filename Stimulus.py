@@ -1,8 +1,21 @@
-import imageio, pygame, io, os
-from pygame.locals import *
+import io, os
 from Database import *
+from Registry import LazyModule
 import numpy as np
+import time
 from Timer import *
+from ClipCache import ClipCache
+from ClipStore import ClipStore
+from Frames import FrameStore, FrameStream
+from GratingCache import GratingCache, make_lut
+from SurfaceCache import get_surface_cache
+from Photodiode import amplitude_table, CODE_MASK
+from Players import PlayerPool
+from Metrics import counter, histogram
+imageio = LazyModule('imageio')  # ffmpeg is only loaded by the stimuli that decode movies
+pygame = LazyModule('pygame')    # SDL is only loaded when a screen is set up
+FLIPS = counter('flips')
+FLIP_INTERVAL = histogram('flip_interval_ms', (8, 12, 17, 20, 25, 34, 50, 100))
 
 class Stimulus:
     """ This class handles the stimulus presentation
@@ -15,21 +28,41 @@ class Stimulus:
         self.beh = beh
         self.isrunning = False
         self.flip_count = 0
+        self.trial_flips = 0
+        self.last_flip = None
+        self.manifest = dict()  # prepared conditions, stored in checkpoints
 
     def setup(self):
         # setup parameters
-        self.path = 'stimuli/'     # default path to copy local stimuli
-        self.size = (800, 480)     # window size
+        self.path = self.logger.setup_conf.get('stim_path', 'stimuli/')  # path to copy local stimuli, may be shared
+        self.size = tuple(self.logger.setup_conf.get('resolution', (800, 480)))  # window size
         self.color = [127, 127, 127]  # default background color
         self.loc = (0, 0)          # default starting location of stimulus surface
         self.fps = 30              # default presentation framerate
         self.phd_size = (50, 50)    # default photodiode signal size in pixels
+        self.photodiode = self.logger.setup_conf.get('photodiode', False)  # encode flip numbers on the photodiode
+        self.clip_cache_size = self.logger.setup_conf.get('clip_cache_size', 10e9)  # local clip cache budget (bytes)
+        self.predecode = self.logger.setup_conf.get('predecode', False)  # decode movies once to memory mapped frames
+        self.frame_store_size = self.logger.setup_conf.get('frame_store_size', 20e9)  # decoded frames budget (bytes)
+        self.frame_queue = self.logger.setup_conf.get('frame_queue', 8)  # frames decoded ahead of presentation
+        self.palette_gratings = self.logger.setup_conf.get('palette_gratings', False)  # drift by palette rotation
+        self.surfaces = get_surface_cache(self.logger.setup_conf.get('surface_cache_size', 200e6))  # bytes, shared
+        self.max_flips = 2 ** 16                                 # flip times recorded per trial
+        self.store_flip_times = self.logger.setup_conf.get('store_flip_times', False)  # keep the raw flip times
+        self.flip_times = np.zeros(self.max_flips)              # preallocated, so recording does not allocate
+        self.pacer = FramePacer(self.fps)                        # sleeps most of the frame interval instead of spinning
 
         # setup pygame
+        if self.logger.setup_conf.get('headless'):  # render without a display, e.g. for benchmarks on a server
+            driver = self.logger.setup_conf['headless']
+            os.environ['SDL_VIDEODRIVER'] = driver if isinstance(driver, str) else 'dummy'  # or 'offscreen'
         pygame.init()
         self.screen = pygame.display.set_mode(self.size)
         #self.screen = pygame.display.set_mode(self.size, NOFRAME | HWSURFACE | DOUBLEBUF | RESIZABLE)
         #self.screen = pygame.display.set_mode(self.size, pygame.HWSURFACE | pygame.DOUBLEBUF)
+        self.phd_table = amplitude_table()  # precomputed photodiode code
+        self.phd_surf = pygame.Surface(self.phd_size).convert()
+        self.phd_colors = [self.phd_surf.map_rgb((amp, amp, amp)) for amp in range(256)]
         self.unshow()
         pygame.mouse.set_visible(0)
         #pygame.display.toggle_fullscreen()
@@ -38,6 +71,19 @@ class Stimulus:
         """prepares stuff for presentation before experiment starts"""
         pass
 
+    def resume(self, conditions, manifest):
+        """prepares stuff again from the manifest of a checkpoint, without the database lookups"""
+        self.manifest = manifest
+        self.prepare(conditions)
+
+    def get_manifest(self):
+        """prepared conditions & clips, for checkpoints"""
+        return getattr(self, 'manifest', dict())  # the matlab stimuli do not call Stimulus.__init__
+
+    def load_trial(self, cond=False):
+        """preload stuff for the next trial"""
+        pass
+
     def init_trial(self, cond=False):
         """initialize stuff for each trial"""
         pass
@@ -54,37 +100,117 @@ class Stimulus:
         """method to get the stimulus condition table"""
         pass
 
+    def cleanup(self):
+        """cleanup stuff after the session"""
+        pass
+
     def unshow(self, color=False):
         """update background color"""
         if not color:
             color = self.color
         self.screen.fill(color)
         self.flip()
+        self.last_flip = None  # the gap until the next trial is not a flip interval
 
     def encode_photodiode(self):
-        """Encodes the flip number n in the flip amplitude.
-        Every 32 sequential flips encode 32 21-bit flip numbers.
-        Thus each n is a 21-bit flip number:
-        FFFFFFFFFFFFFFFFCCCCP
-        P = parity, only P=1 encode bits
-        C = the position within F
-        F = the current block of 32 flips
-        """
-        n = self.flip_count + 1
-        amp = 127 * (n & 1) * (2 - (n & (1 << (((np.int64(np.floor(n / 2)) & 15) + 6) - 1)) != 0))
-        surf = pygame.Surface(self.phd_size)
-        surf.fill((amp, amp, amp))
-        self.screen.blit(surf, (0, 0))
+        """Encodes the flip number n in the flip amplitude, see Photodiode for the code & its decoder"""
+        self.phd_surf.fill(self.phd_colors[self.phd_table[(self.flip_count + 1) & CODE_MASK]])
+        self.screen.blit(self.phd_surf, (0, 0))
 
     def flip(self):
         """ Main flip method"""
         pygame.display.update()
+        now = time.perf_counter()
+        if self.isrunning and self.trial_flips < self.max_flips:
+            self.flip_times[self.trial_flips] = now
+            self.trial_flips += 1
+        if self.last_flip is not None:
+            FLIP_INTERVAL.observe((now - self.last_flip) * 1000)
+        self.last_flip = now
+        FLIPS.inc()
         for event in pygame.event.get():
-            if event.type == QUIT:
+            if event.type == pygame.QUIT:
                 pygame.quit()
 
         self.flip_count += 1
 
+    def flip_summary(self):
+        """Summarizes the flip times of the trial and resets them
+        dropped frames are counted against the target interval of self.fps
+        """
+        if self.trial_flips < 2:
+            self.trial_flips = 0
+            return False
+        times = self.flip_times[:self.trial_flips]
+        ifi = np.diff(times) * 1000
+        target_ifi = 1000 / self.fps
+        stats = dict(flips=self.trial_flips,
+                     dropped_frames=int(np.sum(np.maximum(np.round(ifi / target_ifi) - 1, 0))),
+                     target_ifi=target_ifi,
+                     ifi_mean=np.mean(ifi),
+                     ifi_std=np.std(ifi),
+                     ifi_min=np.min(ifi),
+                     ifi_max=np.max(ifi))
+        stats['ifi_p50'], stats['ifi_p95'], stats['ifi_p99'] = np.percentile(ifi, [50, 95, 99])
+        if self.store_flip_times:  # convert to ms from session start
+            offset = time.time() - time.perf_counter() - self.logger.timer.start_time
+            stats['flip_times'] = np.float32((times + offset) * 1000)
+        self.trial_flips = 0
+        return stats
+
+    def print_pacing(self):
+        """Reports the achieved vs the target frame interval of the trial"""
+        self.pacing_stats = self.pacer.stats()
+        print('Paced %(frames)d frames at %(mean).2f+-%(std).2f ms (max %(max).2f) for %(target).2f ms, '
+              '%(late)d late, margin %(margin).2f ms, %(spin).0f%% spinning' % self.pacing_stats)
+
+    def _get_condition(self, condition_table, cond, *attrs):
+        """parameters of a condition, kept in the manifest so that a resumed session does not fetch them again"""
+        conditions = self.manifest.setdefault(condition_table.__name__, dict())
+        if str(cond) not in conditions:
+            conditions[str(cond)] = self.logger.get_condition(condition_table, cond, *attrs)
+        params = conditions[str(cond)]
+        return dict(params) if isinstance(params, dict) else tuple(params)
+
+    def _prepare_clips(self, conditions):
+        """make sure the clips of all conditions are in the local clip cache"""
+        self.clips = ClipCache(self.path + 'clips/', self.clip_cache_size,
+                               store=ClipStore(self.logger.setup_conf.get('clip_store', '/mnt/clips/')))
+        resumed = MovieClipCond.__name__ in self.manifest
+        self.clip_keys = dict()
+        for cond in conditions:
+            movie_name, clip_number = self._get_condition(MovieClipCond, cond, 'movie_name', 'clip_number')
+            self.clip_keys[cond] = dict(movie_name=movie_name, clip_number=clip_number)
+        self.clips.prefetch(list(self.clip_keys.values()), verify=not resumed)  # verified when first prepared
+
+    def _prepare_player(self):
+        """pool of players that keeps the next clip loaded, 'dummy' player setup option for testing"""
+        if self.logger.setup_conf.get('player') == 'dummy':
+            from Players import DummyPlayer as player
+        else:
+            from omxplayer import OMXPlayer as player
+        self.player = PlayerPool(player, ['--win', '0 15 800 465', '--no-osd'])
+
+    def _load_clip(self, cond):
+        try:
+            self.player.load(self._get_clip(cond))
+        except:
+            print('Could not preload the clip of condition %d' % cond)  # retried when the trial starts
+
+    def _play_clip(self, cond):
+        try:
+            self.vid, self.onset = self.player.play(self._get_clip(cond))  # start video
+        except:
+            self.logger.update_setup_notes('dbError')
+            raise SystemError('DBus cannot connect to the OMXPlayer process')
+
+    def _get_clip(self, cond):
+        """local filename of the clip of a condition"""
+        filename = self.clips.get(self.clip_keys[cond])
+        if not filename:  # evicted by another setup sharing the cache
+            filename = self.clips.prefetch([self.clip_keys[cond]])[0]
+        return filename
+
     def close(self):
         """Close stuff"""
         pygame.mouse.set_visible(1)
@@ -94,64 +220,84 @@ class Stimulus:
 
 class Movies(Stimulus):
     """ This class handles the presentation of Movies"""
+    def prepare(self, conditions):
+        self._prepare_clips(conditions)
+        if self.predecode:
+            self.frame_store = FrameStore(self.path + 'frames/', self.frame_store_size)
+            self.frame_store.prepare([self._get_clip(cond) for cond in conditions])
+
     def init_trial(self, cond):
         self.curr_frame = 1
-        self.clock = pygame.time.Clock()
-        clip_info = (Movie() * Movie.Clip() * MovieClipCond() & dict(cond_idx=cond) & self.logger.session_key).fetch1()
-        self.vid = imageio.get_reader(io.BytesIO(clip_info['clip'].tobytes()), 'ffmpeg')
-        self.vsize = (clip_info['frame_width'], clip_info['frame_height'])
+        self.pacer.start()
+        if self.predecode:
+            self.vid = self.frame_store.get(self._get_clip(cond))  # (n_frames, height, width, 3) memory map
+            self.n_frames = self.vid.shape[0]
+            self.vsize = (self.vid.shape[2], self.vid.shape[1])
+        else:
+            vid = imageio.get_reader(self._get_clip(cond), 'ffmpeg')
+            self.n_frames = vid.get_length()
+            self.vsize = tuple(vid.get_meta_data()['size'])
+            self.vid = FrameStream(vid, self.__get_ring(self.vsize))  # decode in the background
         self.pos = np.divide(self.size, 2) - np.divide(self.vsize, 2)
         self.isrunning = True
         self.logger.start_trial(cond)  # log start trial
         return cond
 
     def present_trial(self):
-        if self.curr_frame < (self.vid.get_length()):
-            py_image = pygame.image.frombuffer(self.vid.get_next_data(), self.vsize, "RGB")
+        if self.curr_frame < self.n_frames:
+            if self.predecode:
+                frame = self.vid[self.curr_frame - 1]  # zero copy
+            else:
+                frame = self.vid.pop()
+            if frame is None:  # clip shorter than its reported length
+                self.isrunning = False
+                return
+            py_image = pygame.image.frombuffer(frame, self.vsize, "RGB")
             self.screen.blit(py_image, self.pos)
+            if self.photodiode:
+                self.encode_photodiode()
+            if not self.predecode:
+                self.vid.release()  # buffer can be decoded into again
             self.flip()
             self.curr_frame += 1
-            self.clock.tick_busy_loop(self.fps)
+            self.pacer.tick()
         else:
             self.isrunning = False
 
     def stop_trial(self):
-        self.vid.close()
-        self.unshow()
+        if not self.predecode:
+            self.vid.close()
+            self.surfaces.print_stats()
+            self.stream_stats = self.vid.stats()
+            print('Decoded %(frames)d frames, %(underruns)d underruns, queue depth %(mean_depth).1f, '
+                  'decode time %(mean_decode).1f/%(max_decode).1f ms' % self.stream_stats)
         self.isrunning = False
-        self.logger.log_trial()  # log trial
+        self.print_pacing()
+        flip_stats = self.flip_summary()
+        self.unshow()
+        self.logger.log_trial(flip_stats=flip_stats)  # log trial
 
     def get_condition_table(self):
         return MovieClipCond
 
+    def __get_ring(self, vsize):
+        """preallocated frame buffers of the stream, reused for clips of the same size"""
+        return self.surfaces.get(('ring', vsize, self.frame_queue),
+                                 lambda: np.empty((self.frame_queue, vsize[1], vsize[0], 3), dtype=np.uint8))
+
 
 class RPMovies(Stimulus):
     """ This class handles the presentation of Movies with an optimized library for Raspberry pi"""
     def prepare(self, conditions):
-        from omxplayer import OMXPlayer
-        self.player = OMXPlayer
-        # store local copy of files
-        if not os.path.isdir(self.path):  # create path if necessary
-            os.makedirs(self.path)
-        for cond_idx in conditions:
-            filename = self.path + \
-                       (Movie.Clip() * MovieClipCond() & dict(cond_idx=cond_idx) & self.logger.session_key).fetch1(
-                           'file_name')
-            if not os.path.isfile(filename):
-                (Movie.Clip() * MovieClipCond() & dict(cond_idx=cond_idx) & self.logger.session_key).fetch1(
-                    'clip').tofile(filename)
+        self._prepare_player()
+        self._prepare_clips(conditions)  # store local copy of files
+
+    def load_trial(self, cond):
+        self._load_clip(cond)
 
     def init_trial(self, cond):
         self.isrunning = True
-        filename = self.path + (Movie.Clip() * MovieClipCond() & dict(cond_idx=cond) &
-                                     self.logger.session_key).fetch1('file_name')
-        try:
-            self.vid = self.player(filename, args=['--win', '0 15 800 465', '--no-osd'],
-                                   dbus_name='org.mpris.MediaPlayer2.omxplayer0')  # start video
-        except:
-            self.logger.update_setup_notes('dbError')
-            raise SystemError('DBus cannot connect to the OMXPlayer process')
-
+        self._play_clip(cond)
         self.logger.start_trial(cond)  # log start trial
         return cond
 
@@ -163,32 +309,50 @@ class RPMovies(Stimulus):
         self.unshow()
         self.isrunning = False
         self.logger.log_trial(self.flip_count)  # log trial
+        self.logger.log_trial_info(PlayerOnset, self.onset)
 
     def get_condition_table(self):
         return MovieClipCond
 
+    def cleanup(self):
+        self.player.close()
+
 
 class Gratings(Stimulus):
     """ This class handles the presentation orientations"""
     def prepare(self, conditions):
-        self.clock = pygame.time.Clock()
         self.stim_conditions = dict()
         self.timer = Timer()
         self.timer.start()
         for cond in conditions:
-            params = (GratingCond() & dict(cond_idx=cond) & self.logger.session_key).fetch1()
-            params['grating'] = self.__make_grating(params['spatial_period'],
-                                                    params['direction'],
-                                                    params['phase'],
-                                                    params['contrast'],
-                                                    params['square'])
-            self.stim_conditions[cond] = params
+            self.stim_conditions[cond] = self._get_condition(GratingCond, cond)
+        if self.palette_gratings:  # screen sized phase gratings, luminance comes from the palette
+            gratings = [(self.size, params['spatial_period'], params['direction'], params['phase'])
+                        for params in self.stim_conditions.values()]
+        else:
+            gratings = [(self.size, params['spatial_period'], params['direction'], params['phase'],
+                         params['contrast'], params['square']) for params in self.stim_conditions.values()]
+        filenames = GratingCache(self.path + 'gratings/').prepare(gratings)  # generated in parallel & cached
+        for params, filename in zip(self.stim_conditions.values(), filenames):
+            params['filename'] = filename  # surfaces are loaded from the disk cache when needed
+            if self.palette_gratings:
+                params['palette'] = np.repeat(make_lut(params['contrast'], params['square'], 256)[:, np.newaxis], 3, 1)
+
+    def load_trial(self, cond):
+        filename = self.stim_conditions[cond]['filename']
+        if self.__surface_key(filename) not in self.surfaces:  # only the array is read in the background
+            self.surfaces.warm(('grating_array', filename), lambda: np.load(filename))
 
     def init_trial(self, cond):
-        self.grating = self.stim_conditions[cond]['grating']
+        filename = self.stim_conditions[cond]['filename']
+        self.grating = self.surfaces.get(self.__surface_key(filename), lambda: self.__load_surface(filename))
         self.lamda = self.stim_conditions[cond]['spatial_period']
         self.frame_step = self.lamda * (self.stim_conditions[cond]['temporal_freq'] / self.fps)
         self.frame_idx = 0
+        self.temporal_freq = self.stim_conditions[cond]['temporal_freq']
+        self.palette = self.stim_conditions[cond].get('palette')
+        self.trial_start = time.perf_counter()
+        self.pacer.start()
         self.xt = np.cos((self.stim_conditions[cond]['direction'] / 180) * np.pi)
         self.yt = np.sin((self.stim_conditions[cond]['direction'] / 180) * np.pi)
         self.logger.start_trial(cond)  # log start trial
@@ -196,52 +360,66 @@ class Gratings(Stimulus):
         return cond
 
     def present_trial(self):
-        displacement = np.mod(self.frame_idx * self.frame_step, self.lamda)
-        self.screen.blit(self.grating,
-                         (-self.lamda + self.yt * displacement,
-                          -self.lamda + self.xt * displacement))
-        #self.encode_photodiode()
-        self.clock.tick_busy_loop(self.fps)
+        if self.palette_gratings:  # phase from the trial time, so dropped frames do not slow the drift
+            cycles = (time.perf_counter() - self.trial_start) * self.temporal_freq
+            self.grating.set_palette(np.roll(self.palette, int(cycles * 256) % 256, 0))
+            self.screen.blit(self.grating, (0, 0))
+        else:
+            displacement = np.mod(self.frame_idx * self.frame_step, self.lamda)
+            self.screen.blit(self.grating,
+                             (-self.lamda + self.yt * displacement,
+                              -self.lamda + self.xt * displacement))
+        if self.photodiode:
+            self.encode_photodiode()
+        self.pacer.tick()
         self.flip()
         self.frame_idx += 1
 
     def stop_trial(self):
-        self.unshow()
         self.isrunning = False
-        self.logger.log_trial(self.flip_count)  # log trial
+        self.print_pacing()
+        flip_stats = self.flip_summary()
+        self.unshow()
+        self.surfaces.print_stats()
+        self.logger.log_trial(self.flip_count, flip_stats)  # log trial
 
     def get_condition_table(self):
         return GratingCond
 
-    def __make_grating(self, lamda=50, theta=0, phase=0, contrast=100, square=False):
-        """ Makes an oriented grating
-        lamda: wavelength (number of pixels per cycle)
-        theta: grating orientation in degrees
-        phase: phase of the grating
-        """
-        w = np.max(self.size) + 2 * lamda
-        freq = w/lamda  # compute frequency from wavelength
-        # make linear ramp
-        x0 = np.linspace(0, 1, w) - 0.5
-        xm, ym = np.meshgrid(x0, x0)
-        # Change orientation by adding Xm and Ym together in different proportions
-        theta_rad = (theta/180) * np.pi
-        xt = xm * np.cos(theta_rad)
-        yt = ym * np.sin(theta_rad)
-        im = (np.sin(((xt + yt) * freq * 2 * np.pi) + phase)+1)/2
-        if square > 0:
-            im = np.double(im > 0.5)
-        im = np.floor((im*contrast/100 + (100-contrast)/200)*255)
-        grating = np.transpose(np.tile(im, [3, 1, 1]), (1, 2, 0))
-        return pygame.surfarray.make_surface(grating)
+    def __surface_key(self, filename):
+        return ('palette_grating' if self.palette_gratings else 'grating', filename)
+
+    def __load_surface(self, filename):
+        """surface of a grating file, made on the main thread from the array warmed by load_trial"""
+        grating = self.surfaces.pop(('grating_array', filename))
+        if grating is None:
+            grating = np.load(filename)
+        if self.palette_gratings:
+            return pygame.surfarray.make_surface(grating)
+        return self.__make_surface(grating)
+
+    def __make_surface(self, grating):
+        """ Converts a uint8 grating to a surface in the display format"""
+        surface = pygame.surfarray.make_surface(grating)
+        surface.set_palette([(i, i, i) for i in range(256)])
+        return surface.convert()
 
 
 class NoStimulus(Stimulus):
     """ This class does not present any stimulus and water is delivered upon a lick"""
-    
+
+    def setup(self):
+        self.screen = None
+        if self.logger.setup_conf.get('screen', True):  # rigs without a screen skip SDL
+            super(NoStimulus, self).setup()
+
     def prepare(self, conditions=False):
         pass
 
+    def unshow(self, color=False):
+        if self.screen is not None:
+            super(NoStimulus, self).unshow(color)
+
     def init_trial(self, cond=False):
         self.isrunning = True
 
@@ -306,7 +484,7 @@ class Odors(Stimulus):
         self.clock = pygame.time.Clock()
         self.stim_conditions = dict()
         for cond in conditions:
-            params = (MultiOdorCond() & dict(cond_idx=cond) & self.logger.session_key).fetch1()
+            params = self._get_condition(MultiOdorCond, cond)
             self.stim_conditions[cond] = params
 
     def init_trial(self, cond):
@@ -331,34 +509,20 @@ class VisOlf(Stimulus):
     """ This class handles the presentation of Odors & Movies with an optimized library for Raspberry pi"""
 
     def prepare(self, conditions):
-        from omxplayer import OMXPlayer
-        self.player = OMXPlayer
+        self._prepare_player()
         self.clock = pygame.time.Clock()
         self.olf_conditions = dict()
 
-        # store local copy of files
-        if not os.path.isdir(self.path):  # create path if necessary
-            os.makedirs(self.path)
+        self._prepare_clips(conditions)  # store local copy of files
         for cond in conditions:
-            filename = self.path + \
-                       (Movie.Clip() * MovieClipCond() & dict(cond_idx=cond) & self.logger.session_key).fetch1(
-                           'file_name')
-            if not os.path.isfile(filename):
-                (Movie.Clip() * MovieClipCond() & dict(cond_idx=cond) & self.logger.session_key).fetch1(
-                    'clip').tofile(filename)
-            params = (OdorCond() & dict(cond_idx=cond) & self.logger.session_key).fetch1()
+            params = self._get_condition(OdorCond, cond)
             self.olf_conditions[cond] = params
 
-    def init_trial(self, cond):
-        filename = self.path + (Movie.Clip() * MovieClipCond() & dict(cond_idx=cond) &
-                                self.logger.session_key).fetch1('file_name')
-        try:
-            self.vid = self.player(filename, args=['--win', '0 15 800 465', '--no-osd'],
-                                   dbus_name='org.mpris.MediaPlayer2.omxplayer0')  # start video
-        except:
-            self.logger.update_setup_notes('dbError')
-            raise SystemError('DBus cannot connect to the OMXPlayer process')
+    def load_trial(self, cond):
+        self._load_clip(cond)
 
+    def init_trial(self, cond):
+        self._play_clip(cond)
         odor_idx = self.olf_conditions[cond]['odor_idx']
         odor_dur = self.olf_conditions[cond]['odor_dur']
         self.beh.give_odor(odor_idx, odor_dur)
@@ -374,10 +538,14 @@ class VisOlf(Stimulus):
         self.unshow()
         self.isrunning = False
         self.logger.log_trial(self.flip_count)  # log trial
+        self.logger.log_trial_info(PlayerOnset, self.onset)
 
     def get_condition_table(self):
         return [OdorCond, MovieClipCond]
 
+    def cleanup(self):
+        self.player.close()
+
 
 class PTOlf(Stimulus):
     """ This class handles the presentation of Odors & Movies with an optimized library for Raspberry pi"""
@@ -0,0 +1,170 @@
+import os, json, time, socket
+import multiprocessing
+from queue import Empty
+from threading import Thread
+SETUPS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'conf', 'setups.json')
+
+
+def read_setups(conf_file):
+    """ Settings of each setup of a conf file, the keys outside 'setups' are shared by all of them """
+    with open(conf_file) as f:
+        conf = json.load(f)
+    shared = {key: value for key, value in conf.items() if key != 'setups'}
+    setups = [dict(shared, **setup_conf) for setup_conf in conf.get('setups', [])]
+    for setup_conf in setups:
+        if 'channels' in setup_conf:  # json keys are strings
+            setup_conf['channels'] = {port: {int(probe): channel for probe, channel in channels.items()}
+                                      for port, channels in setup_conf['channels'].items()}
+    return setups, shared
+
+
+def load_setup_conf(conf_file=None, setup=None):
+    """ Settings of a setup run standalone, found by its host name in the conf file
+    setups that are not listed get the shared settings, no conf_file reads conf/setups.json if it exists
+    """
+    setup = setup if setup else socket.gethostname()
+    if conf_file is None and not os.path.isfile(SETUPS_FILE):
+        return dict(setup=setup)
+    setups, shared = read_setups(conf_file if conf_file else SETUPS_FILE)
+    for setup_conf in setups:
+        if setup_conf.get('setup') == setup:
+            return setup_conf
+    return dict(shared, setup=setup)
+
+
+def run_setup(setup_conf, reports, report_interval):
+    """ Worker process running one setup
+    environment is set before pygame is loaded, so each worker gets its own display or a headless one
+    """
+    if 'cores' in setup_conf:
+        os.sched_setaffinity(0, setup_conf['cores'])                  # pin to separate cores
+    if 'display' in setup_conf:
+        os.environ['DISPLAY'] = setup_conf['display']                 # X display of this setup, e.g. ':0.1'
+    if 'window_pos' in setup_conf:
+        os.environ['SDL_VIDEO_WINDOW_POS'] = '%d,%d' % tuple(setup_conf['window_pos'])
+    if setup_conf.get('headless'):
+        os.environ['SDL_VIDEODRIVER'] = 'dummy'
+
+    import run
+    from Logger import RPLogger
+    logger = RPLogger(setup_conf)
+    monitor = WorkerMonitor(logger, reports, report_interval)
+    monitor.start()
+    run.main(logger)
+
+
+class WorkerMonitor(Thread):
+    """ Reports the cpu usage and scheduling latency of a worker process
+    latency is the oversleep of a short periodic sleep, which is what the trial loop of the setup experiences
+    """
+
+    def __init__(self, logger, reports, interval=10, period=0.01):
+        super(WorkerMonitor, self).__init__(daemon=True)
+        self.logger = logger
+        self.reports = reports
+        self.interval = interval
+        self.period = period
+
+    def run(self):
+        while True:
+            start, cpu_start = time.time(), time.process_time()
+            lags = []
+            while time.time() - start < self.interval:
+                tic = time.perf_counter()
+                time.sleep(self.period)
+                lags.append(time.perf_counter() - tic - self.period)
+            elapsed = time.time() - start
+            self.reports.put(dict(setup=self.logger.setup,
+                                  pid=os.getpid(),
+                                  cpu=100 * (time.process_time() - cpu_start) / elapsed,
+                                  lag=1000 * sum(lags) / len(lags),
+                                  max_lag=1000 * max(lags),
+                                  trials=getattr(self.logger, 'last_trial', 0)))
+
+
+class Supervisor:
+    """ This class runs multiple independent setups from one host, one worker process per setup
+
+    setups are configured in a json file, keys outside 'setups' are shared by all of them:
+    {"stim_path": "/home/eflab/stimuli/",
+     "setups": [{"setup": "ef-rp01a", "cores": [1], "display": ":0.0",
+                 "channels": {"air": {"1": 24, "2": 25}, "liquid": {"1": 22, "2": 23},
+                              "lick": {"1": 17, "2": 27}, "start": {"1": 9}}},
+                {"setup": "ef-rp01b", "cores": [2], "headless": true, ...},
+                {"setup": "ef-rp02", "screen": false, ...}]}
+    setups run standalone by run.py read the same file, see load_setup_conf
+    """
+
+    def __init__(self, conf_file, report_interval=10):
+        setups, shared = read_setups(conf_file)
+        self.setups = [self.__parse_setup(setup_conf, idx, len(setups)) for idx, setup_conf in enumerate(setups)]
+        self.report_interval = report_interval
+        self.context = multiprocessing.get_context('spawn')  # workers open their own db connection & display
+        self.reports = self.context.Queue()
+        self.workers = dict()
+        self.stats = dict()
+
+    def start(self):
+        for setup_conf in self.setups:
+            self.__start_worker(setup_conf)
+
+    def run(self):
+        """ Monitor workers until all setups are stopped """
+        self.start()
+        last_report = time.time()
+        try:
+            while self.workers:
+                try:
+                    stats = self.reports.get(timeout=1)
+                    self.stats[stats['setup']] = stats
+                except Empty:
+                    pass
+                self.__check_workers()
+                if time.time() - last_report > self.report_interval:
+                    self.report()
+                    last_report = time.time()
+        finally:
+            self.stop()
+
+    def report(self):
+        print('%-20s %7s %7s %9s %9s %7s' % ('setup', 'pid', 'cpu%', 'lag(ms)', 'max(ms)', 'trials'))
+        for setup, stats in sorted(self.stats.items()):
+            print('%-20s %7d %7.1f %9.2f %9.2f %7d' % (setup, stats['pid'], stats['cpu'], stats['lag'],
+                                                        stats['max_lag'], stats['trials']))
+        print('%-20s %7s %7.1f' % ('total', '', sum(stats['cpu'] for stats in self.stats.values())))
+
+    def stop(self):
+        for worker in self.workers.values():
+            worker.terminate()
+            worker.join()
+        self.workers = dict()
+
+    def __start_worker(self, setup_conf):
+        self.__load_calibration(setup_conf)  # current one, also for restarts after a recalibration
+        worker = self.context.Process(target=run_setup, name=setup_conf['setup'],
+                                      args=(setup_conf, self.reports, self.report_interval))
+        worker.start()
+        self.workers[setup_conf['setup']] = worker
+        print('Started %s with pid %d on cores %s' % (setup_conf['setup'], worker.pid, setup_conf['cores']))
+
+    def __check_workers(self):
+        for setup_conf in self.setups:
+            worker = self.workers.get(setup_conf['setup'])
+            if worker is None or worker.is_alive():
+                continue
+            del self.workers[setup_conf['setup']]
+            self.stats.pop(setup_conf['setup'], None)
+            if worker.exitcode != 0:  # restart crashed setups, stopped ones exit cleanly
+                print('%s exited with code %d, restarting' % (setup_conf['setup'], worker.exitcode))
+                self.__start_worker(setup_conf)
+
+    def __load_calibration(self, setup_conf):
+        """ Fetch the calibration of a setup for its worker """
+        from LickSpout import get_calibration
+        setup_conf['calibration'] = get_calibration(setup_conf['setup'])
+
+    def __parse_setup(self, setup_conf, idx, nsetups):
+        ncores = os.cpu_count()
+        if 'cores' not in setup_conf:  # leave core 0 to the supervisor & the OS if possible
+            setup_conf['cores'] = [(idx + 1) % ncores if nsetups < ncores else idx % ncores]
+        return setup_conf
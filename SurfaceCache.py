@@ -0,0 +1,141 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from Metrics import counter, gauge
+HITS = counter('surface_cache_hits')
+MISSES = counter('surface_cache_misses')
+EVICTIONS = counter('surface_cache_evictions')
+RESIDENT = gauge('surface_cache_bytes')
+
+
+def nbytes(value):
+    """ Memory of arrays, surfaces & containers of them """
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    if hasattr(value, 'get_pitch'):  # pygame surface
+        return value.get_pitch() * value.get_height()
+    if isinstance(value, dict):
+        return sum(nbytes(item) for item in value.values())
+    if isinstance(value, (tuple, list)):
+        return sum(nbytes(item) for item in value)
+    return 0
+
+
+class SurfaceCache:
+    """ This class handles a bounded memory cache of stimulus surfaces & frame buffers
+    entries are made by their loader on a miss and the least recently used ones are dropped beyond max_bytes,
+    so the stimulus memory does not grow with the number of conditions. warm() loads the entries expected next
+    in a background thread, a get() of an entry being warmed waits for it instead of loading it again.
+    SDL display calls are not thread safe, so warm loaders only read arrays: the stimulus makes its surfaces
+    from them with get() on the main thread and pop()s the array.
+    The last entry is always kept, even if larger than max_bytes, and an evicted entry stays in memory
+    while the stimulus still holds it.
+    """
+
+    def __init__(self, max_bytes=200e6):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key: (value, bytes), least recently used first
+        self.loading = dict()         # key: event of a load in progress
+        self.lock = threading.Lock()
+        self.warmer = ThreadPoolExecutor(max_workers=1)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, loader):
+        """ Cached value of key, made by loader() on a miss """
+        while True:
+            with self.lock:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    HITS.inc()
+                    return self.entries[key][0]
+                event = self.loading.get(key)
+                if event is None:
+                    event = self.loading[key] = threading.Event()
+                    self.misses += 1
+                    MISSES.inc()
+                    break
+            event.wait()  # loaded by another thread, unless it failed
+        try:
+            value = loader()
+            self.put(key, value)
+        finally:
+            with self.lock:
+                del self.loading[key]
+            event.set()
+        return value
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def pop(self, key):
+        """ Remove an entry, after its load if it is being warmed, returns its value or None """
+        with self.lock:
+            event = self.loading.get(key)
+        if event is not None:
+            event.wait()
+        with self.lock:
+            value, size = self.entries.pop(key, (None, 0))
+            self.bytes -= size
+            RESIDENT.set(self.bytes)
+        return value
+
+    def put(self, key, value):
+        size = nbytes(value)
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes and len(self.entries) > 1:
+                self.bytes -= self.entries.popitem(last=False)[1][1]
+                self.evictions += 1
+                EVICTIONS.inc()
+            RESIDENT.set(self.bytes)
+
+    def warm(self, key, loader):
+        """ Load an entry in the background, returns a future or None if it is cached """
+        with self.lock:
+            if key in self.entries or key in self.loading:
+                return None
+        return self.warmer.submit(self.__warm, key, loader)
+
+    def __warm(self, key, loader):
+        try:
+            with self.lock:
+                if key in self.entries:  # does not count as a hit
+                    return
+            self.get(key, loader)
+        except Exception as error:  # loaded again when the trial needs it
+            print('Could not warm %s: %s' % (key, error))
+
+    def stats(self):
+        with self.lock:
+            return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                        entries=len(self.entries), bytes=self.bytes, max_bytes=self.max_bytes)
+
+    def print_stats(self):
+        print('Surface cache %(entries)d entries, %(bytes).3g of %(max_bytes).3g bytes, '
+              '%(hits)d hits, %(misses)d misses, %(evictions)d evictions' % self.stats())
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+            RESIDENT.set(0)
+
+
+CACHE = None
+
+
+def get_surface_cache(max_bytes=200e6):
+    """ The cache of the process, shared by all the stimuli """
+    global CACHE
+    if CACHE is None:
+        CACHE = SurfaceCache(max_bytes)
+    CACHE.max_bytes = max_bytes
+    return CACHE
@@ -1,6 +1,8 @@
 import sys
 import time
 import threading
+from Metrics import counter
+POLLS = counter('hw_polls')
 
 
 class GetHWPoller(threading.Thread):
@@ -24,6 +26,7 @@ class GetHWPoller(threading.Thread):
         while (1):
             if self.runflag.is_set():
                 self.pollfunc()
+                POLLS.inc()
                 time.sleep(self.sleeptime)
             else:
                 time.sleep(0.01)
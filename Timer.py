@@ -1,5 +1,6 @@
 #from time import time
 import time
+import numpy as np
 
 class Timer:
     """ This is a timer that is used for the state system
@@ -19,3 +20,71 @@ class Timer:
 
     def add_delay(self, sec):
         self.start_time += sec
+
+
+class FramePacer:
+    """ Paces frames at a target rate without spinning the cpu for the whole frame interval
+    sleeps until margin before the deadline and spins for the rest. The margin follows the measured
+    oversleep: it grows at once when a sleep overshoots it and shrinks slowly otherwise.
+    time is in seconds
+    """
+
+    def __init__(self, fps, margin=0.002, min_margin=0.0005, max_margin=0.01, decay=0.05):
+        self.period = 1 / fps
+        self.margin = margin
+        self.min_margin = min_margin
+        self.max_margin = max_margin
+        self.decay = decay
+        self.clock = time.perf_counter
+        self.start()
+
+    def start(self):
+        """ Reset the deadline & the statistics, call at the beginning of each trial """
+        self.last = None
+        self.intervals = []
+        self.late = 0
+        self.slept = 0
+        self.spun = 0
+
+    def tick(self):
+        """ Wait until one period after the previous tick """
+        now = self.clock()
+        if self.last is None:
+            self.last = now
+            return
+        deadline = self.last + self.period
+        wake = deadline - self.margin
+        if now < wake:
+            time.sleep(wake - now)
+            woke = self.clock()
+            self.slept += woke - now
+            self.__tune(woke - wake)
+            now = woke
+        spin_start = now
+        while now < deadline:
+            now = self.clock()
+        self.spun += now - spin_start
+        if now - deadline > self.period:  # missed a frame, restart from now instead of catching up
+            self.late += 1
+            deadline = now
+        self.intervals.append(now - self.last)
+        self.last = deadline
+
+    def stats(self):
+        """ Achieved vs target frame interval (ms), late frames & the share of the waiting that was spinning """
+        intervals = np.array(self.intervals) * 1000 if self.intervals else np.zeros(1)
+        waited = self.slept + self.spun
+        return dict(frames=len(self.intervals),
+                    target=self.period * 1000,
+                    mean=np.mean(intervals),
+                    std=np.std(intervals),
+                    max=np.max(intervals),
+                    late=self.late,
+                    margin=self.margin * 1000,
+                    spin=100 * self.spun / waited if waited > 0 else 0)
+
+    def __tune(self, oversleep):
+        if oversleep > self.margin:
+            self.margin = min(self.max_margin, 1.5 * oversleep)
+        else:
+            self.margin = max(self.min_margin, self.margin - self.decay * (self.margin - oversleep))
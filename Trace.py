@@ -0,0 +1,87 @@
+import time, itertools
+import numpy as np
+
+HOPS = ('lick', 'poll', 'behavior', 'experiment', 'give_liquid', 'pulse', 'valve')  # reward path, in order
+
+
+class LatencyTrace:
+    """ Timestamps of the rewarded licks along the reward path, from the lick callback to the valve opening
+    the lick callbacks only keep the last lick time of each probe. The poll of a probe makes its lick the
+    current one of the trial loop, whose hops are written in a pending row, so they are not charged to licks
+    that come later. give_liquid hands it over to the pulse thread with take(), which only then gives it one of
+    the preallocated rows, so licks that are not rewarded do not use them up. Each hop is only written once and
+    rows are only handed out by the trial loop, so there are no locks.
+    time is in seconds from time.perf_counter
+    """
+
+    def __init__(self, max_events=20000):
+        self.max_events = max_events
+        self.times = np.full((max_events, len(HOPS)), np.nan)
+        self.probes = np.zeros(max_events, dtype=np.int8)
+        self.counter = itertools.count()
+        self.lick_times = dict()         # probe: time of the last lick
+        self.pending = np.full(len(HOPS), np.nan)  # trial loop hops of the polled lick
+        self.current = 0                 # probe of the polled lick, 0 if none
+        self.events = 0
+        self.dropped = 0                 # rewarded licks beyond max_events
+        self.hop_idx = dict((hop, idx) for idx, hop in enumerate(HOPS))
+
+    def start(self, probe):
+        """ Lick at the callback """
+        self.lick_times[probe] = time.perf_counter()
+
+    def poll(self, probe):
+        """ The trial loop took the lick of a probe, the following hops are of it """
+        self.pending[:] = np.nan
+        self.current = probe if probe in self.lick_times else 0
+        self.pending[0] = self.lick_times.get(probe, np.nan)
+        self.mark('poll')
+
+    def mark(self, hop, event=None):
+        """ Time of a hop of the current lick, or of an event handed to another thread """
+        hop = self.hop_idx[hop]
+        if event is None:
+            times = self.pending if self.current else None
+        else:
+            times = self.times[event] if 0 <= event < self.max_events else None
+        if times is not None and np.isnan(times[hop]):
+            times[hop] = time.perf_counter()
+
+    def take(self):
+        """ Hands the current lick over to another thread as a new event, returns its number or -1 """
+        probe, self.current = self.current, 0
+        if not probe:
+            return -1
+        event = next(self.counter)
+        if event >= self.max_events:
+            if not self.dropped:
+                print('Latency trace is full, rewarded licks after %d are not traced' % self.max_events)
+            self.dropped += 1
+            return -1
+        self.times[event] = self.pending
+        self.probes[event] = probe
+        self.events = event + 1
+        return event
+
+    def summary(self):
+        """ Latency of each hop from the previous one and from the lick to the valve (ms), of the rewarded licks
+        returns list of dict(hop, events, dropped, p50, p95, p99, max)
+        """
+        times = self.times[:self.events]
+        times = times[~np.isnan(times[:, -1]) & ~np.isnan(times[:, 0])] * 1000
+        intervals = [('%s-%s' % (HOPS[idx - 1], HOPS[idx]), times[:, idx] - times[:, idx - 1])
+                     for idx in range(1, len(HOPS))]
+        intervals.append(('total', times[:, -1] - times[:, 0]))
+        rows = []
+        for hop, latency in intervals:
+            latency = latency[~np.isnan(latency)]
+            if len(latency):
+                p50, p95, p99 = np.percentile(latency, [50, 95, 99])
+                rows.append(dict(hop=hop, events=len(latency), dropped=self.dropped, p50=p50, p95=p95, p99=p99, max=np.max(latency)))
+        return rows
+
+    def print_summary(self):
+        for row in self.summary():
+            print('%(hop)-24s %(events)6d  p50 %(p50)7.3f  p95 %(p95)7.3f  p99 %(p99)7.3f  max %(max)7.3f ms' % row)
+        if self.dropped:
+            print('%d rewarded licks were not traced' % self.dropped)
@@ -0,0 +1,48 @@
+import sys, time, json, resource, types
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# # # # Startup cost of each rig configuration # # # # #
+# imports the experiment, behavior & stimulus types of each configuration in a fresh process and reports
+# the time, the resident memory & the heavy libraries that were loaded.
+# Configurations with a setup_conf also set up their stimulus with it, e.g. {"screen": false} for a screenless rig:
+# python benchStartup.py [conf/bench.json]
+CONFIGURATIONS = [dict(exp_type='FreeWater', stim_type='NoStimulus', setup_conf=dict(screen=False)),
+                  dict(exp_type='MultiProbe', stim_type='Gratings'),
+                  dict(exp_type='MultiProbe', stim_type='Movies'),
+                  dict(exp_type='CenterPort', stim_type='RPMovies'),
+                  dict(exp_type='PassiveMatlab', stim_type='Psychtoolbox')]
+LIBRARIES = ['datajoint', 'pygame', 'imageio', 'serial', 'RPi', 'omxplayer', 'matlab']
+
+
+def load_configuration(conf):
+    """ Worker process resolving the classes of a configuration """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tic = time.perf_counter()
+    from Registry import get_experiment, get_behavior, get_stimulus
+    experiment = get_experiment(conf['exp_type'])
+    get_behavior(experiment.get_behavior(None))
+    stimulus = get_stimulus(conf['stim_type'])
+    if 'setup_conf' in conf:  # only the setup options are used by the stimulus setup
+        stimulus(types.SimpleNamespace(setup_conf=conf['setup_conf'])).setup()
+    return dict(conf,
+                time=time.perf_counter() - tic,
+                rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10,
+                rss_added=(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) / 2 ** 10,
+                libraries=[library for library in LIBRARIES if library in sys.modules])
+
+
+if __name__ == '__main__':
+    configurations = CONFIGURATIONS
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as f:
+            configurations = json.load(f).get('startup', CONFIGURATIONS)
+    context = multiprocessing.get_context('spawn')
+    print('%-14s %-14s %8s %8s %9s  %s' % ('experiment', 'stimulus', 'time(s)', 'rss(MB)', 'added(MB)', 'libraries'))
+    for conf in configurations:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            result = pool.submit(load_configuration, conf).result()
+        print('%-14s %-14s %8.2f %8.1f %9.1f  %s' % (result['exp_type'], result['stim_type'], result['time'],
+                                                     result['rss'], result['rss_added'],
+                                                     ', '.join(result['libraries'])))
+    sys.exit(0)
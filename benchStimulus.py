@@ -0,0 +1,149 @@
+import os, sys, json, time, socket, shutil, tempfile, resource, subprocess, tracemalloc
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+# # # # Stimulus throughput benchmarks # # # # #
+# runs every benchmark of a json file headless in its own process and appends the results to a json file:
+# python benchStimulus.py conf/bench.json bench_results.json [names]
+
+
+def offline_database():
+    """ Declare the tables of Database without connecting, so the benchmarks run without database access
+    called in the worker processes before anything imports Database
+    """
+    import datajoint as dj
+    dj.schema = lambda *args, **kwargs: lambda table: table
+
+
+def run_bench(bench, shared):
+    """ Worker process running one benchmark, returns its measurements """
+    setup_conf = dict(shared, **bench.get('setup_conf', dict()))
+    setup_conf.setdefault('headless', True)
+    cold = 'stim_path' not in setup_conf  # prepare from empty caches unless a stim_path is given
+    if cold:
+        setup_conf['stim_path'] = tempfile.mkdtemp() + '/'
+    offline_database()
+    from Logger import Logger
+    from ClipCache import ClipCache
+    import Stimulus
+
+    class BenchLogger(Logger):
+        """ Logger serving the benchmark conditions from memory, logs nothing """
+
+        def __init__(self, setup_conf, conditions):
+            self.session_key = dict()
+            self.setup_conf = setup_conf
+            self.setup = setup_conf.get('setup', socket.gethostname())
+            self.conditions = conditions
+            self.init_params()
+
+        def get_condition(self, condition_table, cond_idx, *attrs):
+            params = self.conditions[cond_idx]
+            return tuple(params[attr] for attr in attrs) if attrs else params
+
+    conditions = dict(enumerate(bench.get('conditions', []), start=1))
+    if 'clips' in bench:  # movie benchmarks play local files through the clip cache
+        clips = ClipCache(setup_conf['stim_path'] + 'clips/', setup_conf.get('clip_cache_size', 10e9))
+        for clip_number, clip_file in enumerate(bench['clips'], start=1):
+            key = dict(movie_name='bench', clip_number=clip_number)
+            clips.put(key, np.fromfile(clip_file, dtype=np.uint8), clip_file)
+            conditions[clip_number] = key
+
+    logger = BenchLogger(setup_conf, conditions)
+    stim = getattr(Stimulus, bench['stim_type'])(logger)
+    stim.setup()
+    stim.pacer = Stimulus.FramePacer(float('inf'))  # free running, measures the render cost only
+
+    tracemalloc.start()
+    tic = time.perf_counter()
+    stim.prepare(list(conditions.keys()))
+    prepare_time = time.perf_counter() - tic
+
+    frame_times = []
+    for cond in (conditions.keys() if conditions else [False]):
+        stim.init_trial(cond)
+        for frame in range(bench.get('frames', 300)):
+            tic = time.perf_counter()
+            stim.present_trial()
+            frame_times.append(time.perf_counter() - tic)
+            if not stim.isrunning:
+                break
+        stim.stop_trial()
+    heap_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    stim.close()
+    if cold:
+        shutil.rmtree(setup_conf['stim_path'])
+
+    frame_times = np.array(frame_times) * 1000
+    return dict(name=bench['name'],
+                stim_type=bench['stim_type'],
+                resolution=list(stim.size),
+                conditions=len(conditions),
+                frames=len(frame_times),
+                prepare_time=prepare_time,
+                frame_mean=np.mean(frame_times),
+                frame_p50=np.percentile(frame_times, 50),
+                frame_p95=np.percentile(frame_times, 95),
+                frame_p99=np.percentile(frame_times, 99),
+                frame_max=np.max(frame_times),
+                max_fps=1000 / np.mean(frame_times),
+                sustained_fps=1000 / np.percentile(frame_times, 99),   # 99% of the frames render in time
+                heap_peak=heap_peak / 2 ** 20,
+                rss_peak=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10)
+
+
+def run_benchmarks(conf_file, names=()):
+    with open(conf_file) as f:
+        conf = json.load(f)
+    shared = {key: value for key, value in conf.items() if key not in ('benchmarks', 'startup', 'trials')}
+    context = multiprocessing.get_context('spawn')  # fresh interpreter per benchmark, so memory peaks are separate
+    results = []
+    for bench in conf['benchmarks']:
+        if names and bench['name'] not in names:
+            continue
+        missing = [clip_file for clip_file in bench.get('clips', []) if not os.path.isfile(clip_file)]
+        if missing:
+            print('Skipping %s, missing %s' % (bench['name'], ', '.join(missing)))
+            continue
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:  # workers may start their own pools
+            result = pool.submit(run_bench, bench, shared).result()
+        results.append({key: float(value) if isinstance(value, np.floating) else value
+                        for key, value in result.items()})
+        print('%(name)-24s prepare %(prepare_time)7.2f s  frame %(frame_mean)6.2f/%(frame_p99)6.2f ms  '
+              'fps %(max_fps)7.1f/%(sustained_fps)7.1f  heap %(heap_peak)7.1f MB  rss %(rss_peak)7.1f MB' % result)
+    return results
+
+
+def save_results(results_file, results, metrics=('frame_mean', 'prepare_time')):
+    """ Append a run to the results file and compare its metrics with the previous run """
+    runs = []
+    if os.path.isfile(results_file):
+        with open(results_file) as f:
+            runs = json.load(f)
+    try:
+        version = subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                          cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        version = ''
+    if runs:
+        previous = dict((result['name'], result) for result in runs[-1]['results'])
+        for result in results:
+            if result['name'] in previous:
+                print('%-24s %s  vs %s' % (result['name'], '  '.join(
+                    '%s %+6.1f%%' % (metric, 100 * (result[metric] / max(previous[result['name']][metric], 1e-6) - 1))
+                    for metric in metrics), runs[-1]['version']))
+    runs.append(dict(version=version, host=socket.gethostname(), date=time.strftime('%Y-%m-%d %H:%M:%S'),
+                     results=results))
+    tmp_file = '%s.%d.tmp' % (results_file, os.getpid())
+    with open(tmp_file, 'w') as f:
+        json.dump(runs, f, indent=1)
+    os.replace(tmp_file, results_file)
+
+
+if __name__ == '__main__':
+    conf_file = sys.argv[1] if len(sys.argv) > 1 else 'conf/bench.json'
+    results_file = sys.argv[2] if len(sys.argv) > 2 else 'bench_results.json'
+    save_results(results_file, run_benchmarks(conf_file, sys.argv[3:]))
+    sys.exit(0)
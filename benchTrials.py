@@ -0,0 +1,332 @@
+import os, re, sys, copy, json, time, socket, shutil, tempfile, resource, contextlib
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+from benchStimulus import save_results, offline_database
+
+# # # # Trial loop benchmarks # # # # #
+# runs sessions of the trials section of a json file with scripted licks, a headless stimulus & in memory tables
+# and appends the per trial costs to a json file:
+# python benchTrials.py conf/bench.json bench_trials.json [names]
+# rig time runs time_scale times faster than real time, so that 10k trials take minutes
+LOGGED = ('Trial', 'TrialLicks', 'FlipStats', 'Lick', 'LiquidDelivery', 'AirpuffDelivery', 'OdorDelivery',
+          'PlayerOnset')  # tables that grow every trial only count their rows
+TASK = dict(intertrial_duration=1, trial_duration=30, timeout_duration=0, airpuff_duration=400,
+            response_interval=1000, reward_amount=8, silence_thr=10 ** 6, init_duration=0, delay_duration=0,
+            randomization='block', start_time=None, stop_time=None)
+CALIBRATION = {1: ([20, 60], [100, 100], [0.2, 0.8]), 2: ([20, 60], [100, 100], [0.2, 0.8])}
+
+
+class MemoryTable:
+    """ In memory stand-in of a database table, counts the calls that would reach the database
+    the bench runs a single session, so any restriction of a table of LOGGED matches all of its rows
+    """
+    calls = 0
+
+    def __init__(self, name, heading=(), primary_key=(), keep=True):
+        self.name = self.__name__ = name  # stands in for the table class
+        self.heading = SimpleNamespace(names=list(heading))
+        self.primary_key = list(primary_key)
+        self.keep = keep
+        self.rows = []
+        self.count = [0]
+        self.restrictions = []
+        self.projection = None
+
+    def __call__(self):
+        return self
+
+    def __and__(self, restriction):
+        view = copy.copy(self)
+        view.restrictions = self.restrictions + [restriction]
+        return view
+
+    def __len__(self):
+        MemoryTable.calls += 1
+        return self.count[0] if not self.keep else len(self.__match())
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __match(self):
+        rows = self.rows
+        for restriction in self.restrictions:
+            restriction = restriction if isinstance(restriction, list) else [restriction]
+            rows = [row for row in rows if any(all(row[attr] == value for attr, value in key.items() if attr in row)
+                                               for key in restriction)]
+        if self.projection is not None:
+            rows = [dict((attr, row[attr]) for attr in self.projection if attr in row) for row in rows]
+        return rows
+
+    def proj(self, *attrs):
+        view = copy.copy(self)
+        view.projection = self.primary_key + list(attrs)
+        return view
+
+    def insert1(self, row, **kwargs):
+        self.insert([row])
+
+    def insert(self, rows, **kwargs):
+        MemoryTable.calls += 1
+        self.count[0] += len(rows)
+        if self.keep:
+            self.rows.extend(dict(row) for row in rows)
+
+    def fetch(self, *attrs, **kwargs):
+        MemoryTable.calls += 1
+        rows = self.__match()
+        if not attrs:
+            return rows
+        values = tuple(np.array([row[attr] for row in rows]) for attr in attrs)
+        return values[0] if len(attrs) == 1 else values
+
+    def fetch1(self, *attrs):
+        MemoryTable.calls += 1
+        rows = self.__match()
+        if len(rows) != 1:
+            raise KeyError('%s: fetch1 matched %d rows' % (self.name, len(rows)))
+        if not attrs:
+            return dict(rows[0])
+        return rows[0][attrs[0]] if len(attrs) == 1 else tuple(rows[0][attr] for attr in attrs)
+
+    def _update(self, attr, value):
+        MemoryTable.calls += 1
+        for row in self.__match():
+            row[attr] = value
+
+    def delete_quick(self):
+        MemoryTable.calls += 1
+        matched = [id(row) for row in self.__match()]
+        self.rows[:] = [row for row in self.rows if id(row) not in matched]
+
+
+def memory_tables(database):
+    """ MemoryTable of each table of a module, with the attributes of its definition """
+    definitions = dict((name, value.definition) for name, value in vars(database).items()
+                       if isinstance(value, type) and isinstance(getattr(value, 'definition', None), str))
+    headings = dict()
+
+    def heading(name):
+        if name not in headings:
+            primary_key, attrs, in_key = [], [], True
+            for line in definitions[name].splitlines():
+                line = line.split('#')[0].strip()
+                if line.startswith('---'):
+                    in_key = False
+                elif line.startswith('->'):
+                    parent = line[2:].strip().split('.')[-1]
+                    names = heading(parent)[0] if parent in definitions else []
+                    attrs += names
+                    primary_key += names if in_key else []
+                elif re.match(r'^\w+', line):
+                    attr = re.match(r'^\w+', line).group(0)
+                    attrs.append(attr)
+                    primary_key += [attr] if in_key else []
+            headings[name] = (primary_key, attrs)
+        return headings[name]
+    return dict((name, MemoryTable(name, heading(name)[1], heading(name)[0], name not in LOGGED))
+                for name in definitions)
+
+
+def run_bench(bench, shared):
+    """ Worker process running one session, returns its measurements """
+    setup_conf = dict(shared, **bench.get('setup_conf', dict()))
+    setup_conf.setdefault('headless', True)
+    setup_conf.setdefault('checkpoint', False)
+    setup_conf['calibration'] = CALIBRATION
+    setup_conf['stim_path'] = tempfile.mkdtemp() + '/'
+    scale = bench.get('time_scale', 100)
+    offline_database()  # tables are replaced by memory tables below
+    import Database, Logger, Experiment, Stimulus, Registry
+    from Timer import Timer
+    from LickSpout import Probe
+    from Behavior import RPBehavior
+
+    # in memory tables instead of the database
+    tables = memory_tables(Database)
+    for module in (Logger, Experiment, Stimulus):
+        for name, table in tables.items():
+            if hasattr(module, name):
+                setattr(module, name, table)
+    params = dict(TASK, task_idx=1, exp_type=bench['exp_type'], stim_type=bench['stim_type'],
+                  **bench.get('task', dict()))
+    conditions_file = os.path.join(setup_conf['stim_path'], 'conditions.py')
+    with open(conditions_file, 'w') as f:
+        f.write('global conditions\nconditions = %r\n' % bench.get('conditions', [dict(probe=1)]))
+    tables['Task'].insert1(dict(params, conditions=conditions_file))
+    tables['SetupInfo'].insert1(dict(setup='bench', animal_id=0, task_idx=1, state='running', ip='127.0.0.1'))
+
+    class BenchTimer(Timer):
+        """ Rig time running scale times faster """
+        def elapsed_time(self):
+            return int((self.time() - self.start_time) * 1000 * scale)
+
+    class ScriptedProbe(Probe):
+        """ Licks lick_delay (ms of rig time) after the trial start, at the reward probe with probability accuracy
+        the reward path is traced like on the rig, up to the start of the liquid pulse
+        """
+        def __init__(self, logger):
+            super(ScriptedProbe, self).__init__(logger)
+            self.experiment = None
+            self.random = np.random.RandomState(bench.get('seed', 0))
+            self.start_trial()
+
+        def start_trial(self):
+            self.lick_at = time.perf_counter() + self.random.uniform(*bench.get('lick_delay', (100, 500))) / 1000 / scale
+            self.licked = False
+
+        def lick(self):
+            if not self.licked and time.perf_counter() >= self.lick_at:
+                self.licked = True
+                reward_probe = getattr(self.experiment, 'reward_probe', [])
+                probe = int(reward_probe) if np.size(reward_probe) == 1 else 1
+                if self.random.rand() >= bench.get('accuracy', 1):
+                    probe = 3 - probe
+                getattr(self, 'probe%d_licked' % probe)(0)
+            return super(ScriptedProbe, self).lick()
+
+        def in_position(self):
+            return True, self.timer_ready.elapsed_time() * scale
+
+        def give_liquid(self, probe, duration=False, log=True):
+            if not duration:
+                duration = self.liquid_dur[probe]
+            self.logger.trace.mark('give_liquid')
+            self.thread.submit(self.__pulse_out, duration, self.logger.trace.take())
+            if log:
+                self.logger.log_liquid(probe)
+
+        def give_air(self, probe, duration, log=True):
+            if log:
+                self.logger.log_air(probe)
+
+        def __pulse_out(self, duration, event):
+            self.logger.trace.mark('pulse', event)
+            self.logger.trace.mark('valve', event)
+            time.sleep(duration / 1000 / scale)
+
+        def cleanup(self):
+            self.thread.shutdown()
+
+    class BenchBehavior(RPBehavior):
+        def __init__(self, logger, params):
+            self.probe = ScriptedProbe(logger)
+            super(RPBehavior, self).__init__(logger, params)
+            self.resp_int = params['response_interval'] / scale
+
+    class BenchLogger(Logger.RPLogger):
+        def __init__(self, setup_conf):
+            self.session_key = dict()
+            self.setup_conf = setup_conf
+            self.setup = 'bench'
+            self.ip = '127.0.0.1'
+            self.init_params()
+
+    Registry.register('behavior', 'BenchBehavior', BenchBehavior)
+    experiment = Registry.get_experiment(bench['exp_type'])
+    experiment = type(bench['exp_type'], (experiment,), dict(get_behavior=lambda self: 'BenchBehavior'))
+
+    logger = BenchLogger(setup_conf)
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        logger.log_session()
+        timer = BenchTimer()
+        exprmt = experiment(logger, timer, params)
+        exprmt.beh.probe.experiment = exprmt
+        tic = time.perf_counter()
+        exprmt.prepare()
+        prepare_time = time.perf_counter() - tic
+
+        ntrials = bench.get('trials', 10000)
+        samples = dict((name, np.zeros(ntrials)) for name in ('pre_trial', 'trial', 'post_trial', 'inter_trial',
+                                                               'cpu', 'db_calls', 'trial_calls', 'rss'))
+        for trial in range(ntrials):
+            cpu, calls, tic = time.process_time(), MemoryTable.calls, time.perf_counter()
+            exprmt.pre_trial()
+            exprmt.beh.probe.start_trial()
+            toc = time.perf_counter()
+            samples['pre_trial'][trial], tic = toc - tic, toc
+            timer.start()
+            while timer.elapsed_time() < params['trial_duration'] * 1000:
+                samples['trial_calls'][trial] += 1
+                if exprmt.trial():
+                    break
+            toc = time.perf_counter()
+            samples['trial'][trial], tic = toc - tic, toc
+            exprmt.post_trial()
+            toc = time.perf_counter()
+            samples['post_trial'][trial], tic = toc - tic, toc
+            timer.start()
+            while timer.elapsed_time() < params['intertrial_duration'] * 1000:
+                exprmt.inter_trial()
+            samples['inter_trial'][trial] = time.perf_counter() - tic
+            samples['cpu'][trial] = time.process_time() - cpu
+            samples['db_calls'][trial] = MemoryTable.calls - calls
+            samples['rss'][trial] = rss()
+        exprmt.cleanup()
+    shutil.rmtree(setup_conf['stim_path'])
+
+    ms = dict((name, values * 1000) for name, values in samples.items() if name not in ('db_calls', 'trial_calls', 'rss'))
+    hops = dict((row['hop'], row) for row in logger.trace.summary())
+    latency = hops.get('total', dict(events=0, p50=np.nan, p95=np.nan, p99=np.nan))
+    warm = ntrials // 10  # memory growth after the caches are warm
+    growth = np.polyfit(np.arange(warm, ntrials), samples['rss'][warm:], 1)[0] * 1000 if ntrials - warm > 1 else 0
+    return dict(name=bench['name'],
+                exp_type=bench['exp_type'],
+                stim_type=bench['stim_type'],
+                trials=ntrials,
+                time_scale=scale,
+                prepare_time=prepare_time,
+                pre_trial_mean=np.mean(ms['pre_trial']),
+                pre_trial_p99=np.percentile(ms['pre_trial'], 99),
+                post_trial_mean=np.mean(ms['post_trial']),
+                post_trial_p99=np.percentile(ms['post_trial'], 99),
+                trial_call_mean=np.sum(ms['trial']) / max(np.sum(samples['trial_calls']), 1),
+                overhead_mean=np.mean(ms['pre_trial'] + ms['post_trial']),
+                cpu_mean=np.mean(ms['cpu']),
+                cpu_p99=np.percentile(ms['cpu'], 99),
+                latency_p50=latency['p50'],
+                latency_p95=latency['p95'],
+                latency_p99=latency['p99'],
+                latency_hops=dict((hop, float(row['p99'])) for hop, row in hops.items()),
+                rewards=latency['events'],
+                db_calls=np.mean(samples['db_calls']),
+                rss_start=samples['rss'][0],
+                rss_end=samples['rss'][-1],
+                rss_growth=growth)  # MB per 1k trials
+
+
+def rss():
+    """ Current resident memory (MB) """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+
+def run_benchmarks(conf_file, names=()):
+    with open(conf_file) as f:
+        conf = json.load(f)
+    shared = {key: value for key, value in conf.items() if key not in ('benchmarks', 'startup', 'trials')}
+    context = multiprocessing.get_context('spawn')  # fresh interpreter per session, so memory is separate
+    results = []
+    for bench in conf['trials']:
+        if names and bench['name'] not in names:
+            continue
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            result = pool.submit(run_bench, bench, shared).result()
+        results.append({key: float(value) if isinstance(value, np.floating) else value
+                        for key, value in sorted(result.items())})
+        print('%(name)-20s %(trials)6d trials  overhead %(overhead_mean)6.2f ms  cpu %(cpu_mean)6.2f/%(cpu_p99)6.2f ms  '
+              'latency %(latency_p50)6.2f/%(latency_p99)6.2f ms  db %(db_calls)5.1f calls  '
+              'rss %(rss_end)6.1f MB %(rss_growth)+5.2f MB/1k' % result)
+    return results
+
+
+if __name__ == '__main__':
+    conf_file = sys.argv[1] if len(sys.argv) > 1 else 'conf/bench.json'
+    results_file = sys.argv[2] if len(sys.argv) > 2 else 'bench_trials.json'
+    save_results(results_file, run_benchmarks(conf_file, sys.argv[3:]),
+                 metrics=('overhead_mean', 'cpu_mean', 'latency_p99', 'db_calls'))
+    sys.exit(0)
@@ -0,0 +1,8 @@
+from Export import export
+import sys
+
+# # # # Export the completed sessions not yet exported to columnar files # # # # #
+# python exportSessions.py root [animal_id]
+if __name__ == '__main__':
+    export(sys.argv[1], dict(animal_id=int(sys.argv[2])) if len(sys.argv) > 2 else dict())
+    sys.exit(0)
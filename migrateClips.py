@@ -0,0 +1,9 @@
+from ClipStore import ClipStore, migrate_clips
+import sys
+
+# # # # Move the Movie.Clip blobs to the clip store # # # # #
+# python migrateClips.py [store root] [--purge]
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if arg != '--purge']
+    migrate_clips(ClipStore(args[0] if args else '/mnt/clips/'), purge='--purge' in sys.argv)
+    sys.exit(0)
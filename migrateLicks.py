@@ -0,0 +1,8 @@
+from Licks import migrate
+import sys
+
+# # # # Pack the licks of historical sessions into TrialLicks # # # # #
+# python migrateLicks.py [animal_id]
+if __name__ == '__main__':
+    migrate(dict(animal_id=int(sys.argv[1])) if len(sys.argv) > 1 else dict())
+    sys.exit(0)
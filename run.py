@@ -1,29 +1,35 @@
 from Logger import *
-from Experiment import *
-from Stimulus import *
+from Registry import get_experiment, get_behavior
+from Checkpoint import get_checkpoint
+from Supervisor import load_setup_conf
 import sys
 from datetime import datetime, timedelta
 
-logg = RPLogger()                                                     # setup logger & timer
-logg.log_setup()                                                    # publish IP and make setup available
-stim = Stimulus(logg)
-stim.setup()
-stim.unshow([0, 0, 0])
 
-
-def train(logger=logg):
+def train(logger):
     """ Run training experiment """
 
+    checkpoint = get_checkpoint(logger)                                 # live session state on local disk
+
     # # # # # Global Run # # # # #
     while logger.get_setup_state() == 'running':
 
         # # # # # Prepare # # # # #
         logger.init_params()                                            # clear settings from previous session
-        logger.log_session()                                            # start session
+        state = checkpoint.load() if checkpoint else None               # session interrupted by a crash
+        resumed = state is not None and logger.resume_session(state)
+        if not resumed:
+            logger.log_session()                                        # start session
         params = (Task() & dict(task_idx=logger.task_idx)).fetch1()     # get parameters
         timer = Timer()                                                 # main timer for trials
-        exprmt = eval(params['exp_type'])(logger, timer, params)        # get experiment & init
-        exprmt.prepare()                                                # prepare stuff
+        exprmt = get_experiment(params['exp_type'])(logger, timer, params)        # get experiment & init
+        if resumed:
+            print('Resuming session %d at trial %d' % (logger.session_key['session_id'], logger.last_trial))
+            exprmt.resume(state)                                        # restore stuff from the checkpoint
+        else:
+            exprmt.prepare()                                            # prepare stuff
+        if checkpoint:
+            checkpoint.save(dict(logger.get_state(), **exprmt.get_state()), force=True)
 
         # # # # # Session Run # # # # #
         while exprmt.run():
@@ -64,6 +70,8 @@ def train(logger=logg):
 
             # # # # # Post-Trial Period # # # # #
             exprmt.post_trial()
+            if checkpoint:
+                checkpoint.save(dict(logger.get_state(), **exprmt.get_state()))  # every checkpoint_interval
 
             # # # # # Intertrial period # # # # #
             timer.start()
@@ -72,27 +80,27 @@ def train(logger=logg):
 
         # # # # # Cleanup # # # # #
         exprmt.cleanup()
+        if checkpoint:
+            checkpoint.clear()                                          # session ended, start a new one next time
 
 
 
-def calibrate(logger=logg):
+def calibrate(logger):
     """ Lickspout liquid delivery calibration """
     task_idx = (SetupInfo() & dict(setup=logger.setup)).fetch1('task_idx')
+    if CalibrationSweep() & dict(task_idx=task_idx):
+        calibrate_sweep(logger, task_idx)
+        return
     duration, probes, pulsenum, pulse_interval, save, probe_control = \
         (CalibrationTask() & dict(task_idx=task_idx)).fetch1(
             'pulse_dur', 'probe', 'pulse_num', 'pulse_interval', 'save', 'probe_control')
     probes = eval(probes)
-    valve = eval(probe_control)(logger)  # get valve object
+    valve = get_behavior(probe_control)(logger)  # get valve object
     print('Running calibration')
     pulse = 0
-    stim = Stimulus(logger)
-    stim.setup()
-    font = pygame.font.SysFont("comicsansms", 100)
+    stim, show = calibration_screen(logger)
     while pulse < pulsenum:
-        text = font.render('Pulse %d/%d' % (pulse + 1, pulsenum), True, (0, 128, 0))
-        stim.screen.fill((255, 255, 255))
-        stim.screen.blit(text, (stim.size[1]/4, stim.size[1]/2))
-        stim.flip()
+        show('Pulse %d/%d' % (pulse + 1, pulsenum))
         for probe in probes:
             valve.give_liquid(probe, duration, False)               # release liquid
         time.sleep(duration / 1000 + pulse_interval / 1000)         # wait for next pulse
@@ -100,24 +108,79 @@ def calibrate(logger=logg):
     if save == 'yes':
         for probe in probes:
             logger.log_pulse_weight(duration, probe, pulsenum)      # insert
-    stim.screen.fill((255, 255, 255))
-    stim.screen.blit(font.render('Done calibrating', True, (0, 128, 0)), (stim.size[1]/4, stim.size[1]/2))
-    stim.flip()
+        logger.setup_conf.pop('calibration', None)                  # shared calibration is now stale
+    show('Done calibrating')
+    valve.cleanup()
+
+
+def calibrate_sweep(logger, task_idx):
+    """ Multi point calibration of all probes at once, stores the curves if they are valid """
+    import Calibration
+    key = dict(task_idx=task_idx)
+    probes, pulsenum, pulse_interval, save = (CalibrationTask() & key).fetch1(
+        'probe', 'pulse_num', 'pulse_interval', 'save')
+    pulse_durs, probe_control, min_r2 = (CalibrationSweep() & key).fetch1('pulse_durs', 'probe_control', 'min_r2')
+    if not Calibration.can_ask():                                   # weights are typed in after each duration
+        print('Calibration sweep needs a terminal, run it with run.py on the setup instead of the Supervisor')
+        logger.update_setup_notes('calibration needs a terminal')
+        return
+    valve = get_behavior(probe_control)(logger)                     # get valve object
+    print('Running calibration sweep')
+    stim, show = calibration_screen(logger)
+    calibration = Calibration.sweep(valve, eval(probes), eval(pulse_durs), pulsenum, pulse_interval, display=show)
+    valid = True
+    for probe, curve in calibration.items():
+        problems = Calibration.validate(*curve, min_r2=min_r2)
+        slope, intercept, r2 = Calibration.fit(*curve)
+        print('Probe %d: %.3g gr/ms %+.3g gr r2 %.3f %s' % (probe, slope, intercept, r2, '; '.join(problems)))
+        valid = valid and not problems
+    if save == 'yes' and valid:
+        Calibration.save(logger.setup, calibration)
+        logger.setup_conf.pop('calibration', None)                  # shared calibration is now stale
+    show('Done calibrating' if valid else 'Invalid calibration')
     valve.cleanup()
 
 
-# # # # Waiting for instructions loop # # # # #
-while not logg.get_setup_state() == 'stopped':
-    while logg.get_setup_state() == 'ready':                        # wait for remote start
-        time.sleep(1)
-        logg.ping()
-    if not logg.get_setup_state() == 'stopped':                     # run experiment unless stopped
-        #try:
-        eval(logg.get_setup_task())(logg)
-        logg.update_setup_state('ready')                            # update setup state
-        #except:
-        #    print("Unexpected error:", sys.exc_info()[0])
-        #    logg.update_setup_state('stopped', sys.exc_info()[0])
-
-# # # # # Exit # # # # #
-sys.exit(0)
+def calibration_screen(logger):
+    """ Stimulus showing the calibration progress & the function that shows a text """
+    from Stimulus import Stimulus, pygame
+    stim = Stimulus(logger)
+    stim.setup()
+    font = pygame.font.SysFont("comicsansms", 100)
+
+    def show(text):
+        stim.screen.fill((255, 255, 255))
+        stim.screen.blit(font.render(text, True, (0, 128, 0)), (stim.size[1]/4, stim.size[1]/2))
+        stim.flip()
+    return stim, show
+
+
+def main(logg):
+    """ Waiting for instructions loop """
+    logg.log_setup()                                                    # publish IP and make setup available
+    if logg.setup_conf.get('screen', True):                             # rigs without a screen skip SDL
+        from Stimulus import Stimulus
+        stim = Stimulus(logg)
+        stim.setup()
+        stim.unshow([0, 0, 0])
+
+    while not logg.get_setup_state() == 'stopped':
+        while logg.get_setup_state() == 'ready':                        # wait for remote start
+            time.sleep(1)
+            logg.ping()
+        if not logg.get_setup_state() == 'stopped':                     # run experiment unless stopped
+            #try:
+            eval(logg.get_setup_task())(logg)
+            logg.update_setup_state('ready')                            # update setup state
+            #except:
+            #    print("Unexpected error:", sys.exc_info()[0])
+            #    logg.update_setup_state('stopped', sys.exc_info()[0])
+
+
+# python run.py [--conf conf/setups.json]
+if __name__ == '__main__':
+    conf_file = sys.argv[sys.argv.index('--conf') + 1] if '--conf' in sys.argv else None
+    main(RPLogger(load_setup_conf(conf_file)))                          # setup logger & timer
+
+    # # # # # Exit # # # # #
+    sys.exit(0)
@@ -1,15 +1,18 @@
 from Logger import PCLogger
 from ExpControl import ExpControl
+from Supervisor import load_setup_conf
+import sys
 import time as systime
 
-logger = PCLogger()                                                     # setup logger & timer
-logger.log_setup()                                                    # publish IP and make setup available
-ec = ExpControl(logger)
-
-# # # # Waiting for instructions loop # # # # #
-systime.sleep(3)  # wait for 2pmaster to establish db connection and initialize
-while True:
-    cmd = logger.get_setup_state_control()
-    ec.process_command(cmd)
-    systime.sleep(0.1)
+# python runExp.py [--conf conf/setups.json]
+if __name__ == '__main__':
+    conf_file = sys.argv[sys.argv.index('--conf') + 1] if '--conf' in sys.argv else None
+    logger = PCLogger(load_setup_conf(conf_file))                           # setup logger & timer
+    logger.log_setup()                                                    # publish IP and make setup available
+    ec = ExpControl(logger)
 
+    # # # # Waiting for instructions loop # # # # #
+    systime.sleep(3)  # wait for 2pmaster to establish db connection and initialize
+    while True:
+        cmd = ec.get_state_control(timeout=0.1)                             # wait for a command
+        ec.process_command(cmd)
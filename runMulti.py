@@ -0,0 +1,8 @@
+from Supervisor import Supervisor
+import sys
+
+# # # # Run all setups of this host # # # # #
+if __name__ == '__main__':
+    supervisor = Supervisor(sys.argv[1] if len(sys.argv) > 1 else 'conf/setups.json')
+    supervisor.run()
+    sys.exit(0)